@@ -1,3 +1,5 @@
 version = (0, 5, 0)
 
 __version__ = ".".join(map(str, version))
+
+default_app_config = "discussions.apps.DiscussionsConfig"
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def setup_search(using="default", **kwargs):
+    from .search import get_backend
+
+    backend = get_backend()
+
+    if backend is not None and backend.using == using:
+        backend.setup()
+
+
+class DiscussionsConfig(AppConfig):
+    name = "discussions"
+
+    def ready(self):
+        post_migrate.connect(setup_search, sender=self)
@@ -0,0 +1,90 @@
+from django.contrib.auth.models import Group
+
+from . import cache, settings
+from .compat import User
+from .utils import load_class
+
+
+# Every user
+ALL = "all"
+
+GROUP_PREFIX = "group:"
+
+
+def get_audience_key(audience=None):
+    """
+    Returns the key stored on a broadcast discussion for ``audience``.
+
+    :param audience:
+        ``None`` for every user, a :class:`Group` for its members or the
+        name of an audience of ``DISCUSSIONS_BROADCAST_AUDIENCES``.
+
+    :raises ValueError: when the audience is unknown.
+
+    """
+    if audience is None:
+        return ALL
+
+    if isinstance(audience, Group):
+        return "%s%s" % (GROUP_PREFIX, audience.pk)
+
+    if audience in settings.BROADCAST_AUDIENCES:
+        return audience
+
+    raise ValueError("Unknown audience %r" % (audience,))
+
+
+def get_users(key):
+    """ Returns the queryset of users in the audience ``key`` """
+    if key == ALL:
+        return User.objects.all()
+
+    if key.startswith(GROUP_PREFIX):
+        return User.objects.filter(groups=key[len(GROUP_PREFIX):])
+
+    return load_class(settings.BROADCAST_AUDIENCES[key])()
+
+
+def get_audience_keys_for(user):
+    """
+    Returns keys of the audiences ``user`` belongs to, cached for
+    ``DISCUSSIONS_BROADCAST_AUDIENCES_CACHE_TIMEOUT`` seconds.
+
+    """
+    return cache.get_or_compute(
+        cache.audience_keys_key(user.pk),
+        lambda: compute_audience_keys_for(user),
+        settings.BROADCAST_AUDIENCES_CACHE_TIMEOUT,
+    )
+
+
+def compute_audience_keys_for(user):
+    """
+    Returns keys of the audiences ``user`` belongs to, registered
+    audiences are each checked with a query.
+
+    """
+    keys = [ALL]
+
+    if hasattr(user, "groups"):
+        keys.extend(
+            "%s%s" % (GROUP_PREFIX, group_id)
+            for group_id in user.groups.values_list("pk", flat=True)
+        )
+
+    for name, path in settings.BROADCAST_AUDIENCES.items():
+        if load_class(path)().filter(pk=user.pk).exists():
+            keys.append(name)
+
+    return keys
+
+
+def contains(key, user):
+    """ Returns a boolean whether ``user`` belongs to the audience ``key`` """
+    if key == ALL:
+        return True
+
+    if key not in settings.BROADCAST_AUDIENCES and not key.startswith(GROUP_PREFIX):
+        return False
+
+    return get_users(key).filter(pk=user.pk).exists()
@@ -0,0 +1,228 @@
+import random
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+from . import settings
+
+
+LOCK_TIMEOUT = 10
+
+LOCK_WAIT = 0.05
+
+LOCK_RETRIES = 20
+
+
+def get_cache():
+    return caches[settings.CACHE_ALIAS]
+
+
+def make_key(*parts):
+    return ":".join([settings.CACHE_PREFIX] + ["%s" % part for part in parts])
+
+
+def get_or_compute(key, compute, timeout):
+    """
+    Returns the value cached for ``key``, calling ``compute`` to fill
+    the cache when the value is missing or expired.
+
+    Recomputation is single-flight: the caller acquiring a lock recomputes
+    the value while the others are served the expired one, or wait for the
+    new one when there is nothing to serve yet.
+
+    :param timeout:
+        Number of seconds the value is fresh, ``None`` disables the cache.
+
+    """
+    if timeout is None:
+        return compute()
+
+    cache = get_cache()
+    lock_key = "%s:lock" % key
+
+    entry = cache.get(key)
+
+    if entry is not None:
+        value, expires_at = entry
+
+        if expires_at > time.time() or not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        for i in range(LOCK_RETRIES):
+            time.sleep(LOCK_WAIT)
+
+            entry = cache.get(key)
+
+            if entry is not None:
+                return entry[0]
+
+        return compute()
+
+    try:
+        value = compute()
+
+        # Expired values are kept around to be served during recomputation
+        cache.set(key, (value, time.time() + timeout), timeout * 2)
+    finally:
+        cache.delete(lock_key)
+
+    return value
+
+
+def generation_key(user_id):
+    return make_key("generation", user_id)
+
+
+def broadcasts_generation_key():
+    return make_key("generation", "broadcasts")
+
+
+def make_generation():
+    # Microseconds with random low digits, so that a generation is not
+    # reused after an eviction nor when two nodes bump it at once
+    return int(time.time() * 1000000) * 1000 + random.randint(0, 999)
+
+
+def get_generation(user_id):
+    """
+    Returns the generation of the inbox of a user, a value changed by
+    :func:`bump_generations` each time the inbox changes.
+
+    Everything derived from the inbox of the user (counters, rendered rows,
+    ETags) is keyed on its generation instead of being deleted.
+
+    With broadcasts, the generation also moves with
+    :func:`bump_broadcasts_generation`: both values are kept rather than
+    compared, they may be bumped by nodes whose clocks differ.
+
+    """
+    cache = get_cache()
+    keys = [generation_key(user_id)]
+
+    if settings.BROADCASTS:
+        keys.append(broadcasts_generation_key())
+
+    generations = cache.get_many(keys)
+    values = []
+
+    for key in keys:
+        generation = generations.get(key)
+
+        if generation is None:
+            generation = make_generation()
+
+            # Another node may have created it meanwhile, a cache which does
+            # not keep it (dummy or evicting) keeps the new one
+            cache.add(key, generation, None)
+            generation = cache.get(key) or generation
+
+        values.append("%s" % generation)
+
+    return "-".join(values)
+
+
+def _bump(keys):
+    cache = get_cache()
+
+    def bump():
+        generation = make_generation()
+        cache.set_many(dict((key, generation) for key in keys), None)
+
+    bump()
+
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def bump_generations(user_ids):
+    """
+    Moves the inboxes of ``user_ids`` to a new generation, now and once
+    the current transaction is committed so that a value computed in
+    between from uncommitted data is not kept under the new generation.
+
+    """
+    keys = set(generation_key(user_id) for user_id in user_ids)
+
+    if keys:
+        _bump(keys)
+
+
+def bump_broadcasts_generation():
+    """
+    Moves every inbox to a new generation at once, when broadcasts
+    change for users who have no recipient for them.
+
+    """
+    _bump([broadcasts_generation_key()])
+
+
+def discussion_generation_key(discussion_id):
+    return make_key("generation", "discussion", discussion_id)
+
+
+def get_discussion_generations(discussion_ids):
+    """
+    Returns a dict of the generations of ``discussion_ids``, numbers
+    changed by :func:`bump_discussion_generations` each time a discussion
+    changes for all of its participants.
+
+    Inboxes listing a discussion read its generation instead of having
+    their own bumped, the cost of a change does not grow with the number
+    of participants.
+
+    """
+    cache = get_cache()
+    keys = dict(
+        (discussion_generation_key(discussion_id), discussion_id)
+        for discussion_id in discussion_ids
+    )
+
+    generations = cache.get_many(list(keys))
+    missing = dict(
+        (key, make_generation()) for key in keys if generations.get(key) is None
+    )
+
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+
+    return dict((keys[key], generation) for key, generation in generations.items())
+
+
+def bump_discussion_generations(discussion_ids):
+    """
+    Moves ``discussion_ids`` to a new generation, see
+    :func:`bump_generations`.
+
+    """
+    keys = set(
+        discussion_generation_key(discussion_id) for discussion_id in discussion_ids
+    )
+
+    if keys:
+        _bump(keys)
+
+
+def inbox_key(user_id, generation):
+    return make_key("inbox", user_id, generation)
+
+
+def unread_count_key(user_id, generation):
+    return make_key("unread", user_id, generation)
+
+
+def unread_between_key(user_id, sender_id, generation):
+    return make_key("unread", user_id, sender_id, generation)
+
+
+def row_key(discussion_id, user_id, *parts):
+    return make_key("row", discussion_id, user_id, *parts)
+
+
+def messages_key(discussion_id, *parts):
+    return make_key("messages", discussion_id, *parts)
+
+
+def audience_keys_key(user_id):
+    return make_key("audiences", user_id)
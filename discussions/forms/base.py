@@ -3,9 +3,13 @@ from django.utils.translation import ugettext_lazy as _
 
 from ..fields import CommaSeparatedUserField
 from ..models import Discussion, Folder
+from .. import settings
 
 
 class ComposeForm(forms.Form):
+    # Append messages for a single user to their direct discussion
+    reuse_direct_discussion = settings.REUSE_DIRECT_DISCUSSIONS
+
     to = CommaSeparatedUserField(label=_("To"))
     subject = forms.CharField(
         label=_("Subject"),
@@ -35,7 +39,7 @@ class ComposeForm(forms.Form):
         body = self.cleaned_data["body"]
 
         self.discussion = Discussion.objects.send_message(
-            sender, to_user_list, subject, body
+            sender, to_user_list, subject, body, reuse=self.reuse_direct_discussion
         )
 
         return self.discussion
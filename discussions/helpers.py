@@ -5,15 +5,41 @@ from .compat import User
 from .utils import get_profile_model, queryset_to_dict
 
 
+# Columns loaded for inbox rows, the latest message is rendered
+# from its snapshot so Message rows are not loaded
+LIST_DISCUSSION_FIELDS = (
+    "subject",
+    "sender",
+    "created_at",
+    "updated_at",
+    "sender_deleted_at",
+    "recipients_count",
+    "messages_count",
+    "last_seq",
+    "latest_message",
+    "latest_message_excerpt",
+    "latest_message_sender",
+    "participants_snapshot",
+    "audience",
+)
+
+
 def lookup_discussions(recipients):
+    """
+    Attaches discussions to ``recipients`` with their sender and the
+    sender of their latest message in a single query, participants are
+    rendered from their snapshot.
+
+    """
     recipients_by_ids = queryset_to_dict(
         recipients, key="discussion_id", singular=False
     )
 
     discussions = (
         Discussion.objects.filter(pk__in=recipients_by_ids.keys())
-        .select_related("sender")
-        .prefetch_related("recipients")
+        .select_related("sender", "latest_message_sender")
+        .only(*LIST_DISCUSSION_FIELDS)
+        .order_by()
     )
 
     for discussion in discussions:
@@ -34,9 +60,6 @@ def lookup_profiles(recipients):
         except User.DoesNotExist:
             pass
 
-        for user in recipient.discussion.recipients.all():
-            user_ids[user.pk].append(user)
-
     Profile = get_profile_model()
 
     if Profile:
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from discussions.models import Discussion, Recipient
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills denormalized fields of discussions and recipients saved "
+        "before they were introduced, in chunks of discussions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of discussion ids covered by a chunk",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+
+        bounds = Discussion.objects.aggregate(start=Min("pk"), end=Max("pk"))
+
+        if bounds["start"] is None:
+            return
+
+        count = 0
+
+        for start in range(bounds["start"], bounds["end"] + 1, chunk_size):
+            discussion_ids = list(
+                Discussion.objects.filter(
+                    pk__gte=start, pk__lt=start + chunk_size
+                ).values_list("pk", flat=True)
+            )
+
+            if discussion_ids:
+                with transaction.atomic():
+                    self.backfill(discussion_ids)
+
+                count += len(discussion_ids)
+
+        self.stdout.write("Backfilled %d discussions" % count)
+
+    def backfill(self, discussion_ids):
+        Recipient.objects.refresh_sort_keys(discussion_ids)
+        Discussion.objects.refresh_latest_messages(discussion_ids)
+        Discussion.objects.refresh_participants_snapshots(discussion_ids)
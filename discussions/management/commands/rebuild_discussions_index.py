@@ -0,0 +1,84 @@
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from discussions.models import Message
+from discussions.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search index of messages, in chunks indexed in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of message ids covered by a chunk",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of chunks indexed concurrently",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+
+        if backend is None:
+            raise CommandError("DISCUSSIONS_SEARCH_BACKEND is not set")
+
+        chunk_size = options["chunk_size"]
+        workers = options["workers"] if backend.supports_parallel_indexing else 1
+
+        backend.setup()
+
+        # The index is built aside, the current one is still searched
+        building = backend.__class__(
+            using=backend.using, table_name="%s_rebuild" % backend.table_name
+        )
+        building.drop()
+        building.setup()
+
+        bounds = Message.objects.using(backend.using).aggregate(
+            start=Min("pk"), end=Max("pk")
+        )
+
+        chunks = []
+
+        if bounds["start"] is not None:
+            chunks = [
+                (start, start + chunk_size)
+                for start in range(bounds["start"], bounds["end"] + 1, chunk_size)
+            ]
+
+        if workers > 1:
+            pool = ThreadPool(workers)
+
+            try:
+                counts = pool.map(
+                    lambda chunk: self.index_chunk(building, chunk), chunks
+                )
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            counts = [building.index_range(*chunk) for chunk in chunks]
+
+        with transaction.atomic(using=backend.using):
+            # Messages sent meanwhile were only indexed in the current index
+            counts.append(building.index_range((bounds["end"] or 0) + 1))
+
+            backend.replace(building)
+
+        self.stdout.write("Indexed %d messages" % sum(counts))
+
+    def index_chunk(self, backend, chunk):
+        try:
+            return backend.index_range(*chunk)
+        finally:
+            # Each thread has its own connection
+            connections[backend.using].close()
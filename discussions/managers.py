@@ -1,13 +1,42 @@
-from django.db import models
-from django.db.models import Q
+import datetime
+import hashlib
+
+from collections import OrderedDict, defaultdict
+from threading import local
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
 from django.db.models import signals
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.timezone import now as tznow
+
+from . import cache, search, settings
+
+
+# Attempts of :meth:`RecipientManager.insert_missing` racing with
+# concurrent insertions of the same recipients
+INSERT_RETRIES = 3
+
+# Primary keys of recipients being deleted by
+# :meth:`RecipientManager.delete_recipients`, which reconciles them at once
+_deleting = local()
 
 
 class DiscussionManager(models.Manager):
     """ Manager for the :class:`Message` model. """
 
-    def send_message(self, sender, to_user_list, subject, body):
+    def send_message(self, sender, to_user_list, subject, body, reuse=False):
         """
         Send a message from a user, to a user.
 
@@ -19,50 +48,859 @@ class DiscussionManager(models.Manager):
 
         :param message:
             String containing the message.
+
+        :param reuse:
+            When the message is for a single user, append it to the direct
+            discussion between both users if there is one.
+
         :return:
             A Discussion :class:`Discussion`
 
+        The number of queries does not depend on the number of recipients:
+        they are inserted in bulk and counters are computed once, when the
+        first message is saved.
+
+        The first direct discussion between two users is their canonical
+        one, identified by its ``pair_key``.
+
+        """
+        to_user_list = list(to_user_list) + [sender]
+
+        user_ids = set(user.pk for user in to_user_list)
+
+        pair_key = self.get_pair_key(*user_ids) if len(user_ids) == 2 else None
+
+        if pair_key is not None:
+            discussion = self.filter(pair_key=pair_key).first()
+
+            if discussion is not None:
+                if reuse:
+                    return self._reuse(discussion, sender, body)
+
+                pair_key = None
+
+        try:
+            with transaction.atomic():
+                discussion = self.model(
+                    sender=sender,
+                    subject=subject,
+                    recipients_count=len(user_ids),
+                    pair_key=pair_key,
+                )
+                discussion.add_to_participants_snapshot(to_user_list, commit=False)
+                discussion.save()
+
+                discussion.save_recipients(to_user_list, commit=False)
+
+                discussion.add_message(body)
+        except IntegrityError:
+            if pair_key is None:
+                raise
+
+            # The canonical discussion has been created concurrently
+            discussion = self.get(pair_key=pair_key)
+
+            if reuse:
+                return self._reuse(discussion, sender, body)
+
+            return self.send_message(sender, to_user_list[:-1], subject, body)
+
+        return discussion
+
+    def send_broadcast(self, sender, subject, body, audience=None):
+        """
+        Send a message from a user to a whole audience.
+
+        The discussion and its message are saved once, only the recipient
+        of the sender is: users of the audience get theirs when they open
+        the discussion or change its status, until then it is merged into
+        their inbox as unread.
+
+        :param sender:
+            The :class:`User` which sends the message.
+
+        :param audience:
+            ``None`` for every user, a :class:`Group` for its members or
+            the name of an audience of ``DISCUSSIONS_BROADCAST_AUDIENCES``.
+
+        :return:
+            A Discussion :class:`Discussion`
+
+        """
+        from . import audiences
+
+        with transaction.atomic():
+            discussion = self.model(
+                sender=sender,
+                subject=subject,
+                recipients_count=1,
+                audience=audiences.get_audience_key(audience),
+            )
+            discussion.add_to_participants_snapshot([sender], commit=False)
+            discussion.save()
+
+            discussion.save_recipients([sender], commit=False)
+
+            discussion.add_message(body)
+
+        return discussion
+
+    def get_pending_broadcasts(self, user):
+        """
+        Returns broadcast discussions ``user`` receives but has no
+        recipient for yet, none unless ``DISCUSSIONS_BROADCASTS`` is set.
+
+        Users who joined after a broadcast was sent do not receive it, nor
+        do they receive broadcasts without activity during the last
+        ``DISCUSSIONS_BROADCASTS_PENDING_WINDOW`` days. Only the first
+        ``DISCUSSIONS_BROADCASTS_PENDING_LIMIT`` are pending, most recent
+        first: slice the queryset once filtered.
+
+        """
+        from . import audiences
+        from .models import Recipient
+
+        if not settings.BROADCASTS:
+            return self.none()
+
+        qs = self.filter(
+            audience__in=audiences.get_audience_keys_for(user),
+            updated_at__gte=tznow()
+            - datetime.timedelta(days=settings.BROADCASTS_PENDING_WINDOW),
+        ).order_by("-updated_at", "-pk")
+
+        date_joined = getattr(user, "date_joined", None)
+
+        if date_joined is not None:
+            qs = qs.filter(created_at__gte=date_joined)
+
+        return qs.annotate(
+            has_recipient=Exists(
+                Recipient.objects.filter(discussion=OuterRef("pk"), user=user.pk)
+            )
+        ).filter(has_recipient=False)
+
+    def _reuse(self, discussion, sender, body):
+        """
+        Post ``body`` to the direct ``discussion``, participants who had
+        deleted it get it back in their inbox: unread for the other one,
+        read for ``sender``.
+
+        """
+        from .models import Recipient
+
+        STATUS = Recipient.STATUS
+
+        with transaction.atomic():
+            deleted = discussion.recipient_set.filter(status=STATUS.deleted)
+
+            Recipient.objects.update_status(
+                deleted.exclude(user=sender), STATUS.unread, deleted_at=None
+            )
+
+            discussion.add_message(body, sender)
+
+            Recipient.objects.update_status(
+                deleted.filter(user=sender),
+                STATUS.read,
+                deleted_at=None,
+                read_at=tznow(),
+            )
+
+            if discussion.sender_deleted_at:
+                discussion.sender_deleted_at = None
+                self.filter(pk=discussion.pk).update(sender_deleted_at=None)
+
+        return discussion
+
+    def get_pair_key(self, user_id, other_user_id):
+        """ Returns the key of the direct discussion between two users """
+        return "%s:%s" % tuple(sorted([int(user_id), int(other_user_id)]))
+
+    def get_direct_discussion(self, user, other_user):
+        """
+        Returns the canonical direct discussion between two users,
+        ``None`` when there is none.
+
+        """
+        return self.filter(pair_key=self.get_pair_key(user.pk, other_user.pk)).first()
+
+    def update_counters(self, discussion_ids):
+        """
+        Recount recipients and messages of several discussions
+        with a single UPDATE.
+
+        """
+        from .models import Message, Recipient
+
+        def count(model):
+            return Coalesce(
+                Subquery(
+                    model.objects.filter(discussion=OuterRef("pk"))
+                    .order_by()
+                    .values("discussion")
+                    .annotate(count=Count("pk"))
+                    .values("count")
+                ),
+                0,
+            )
+
+        self.filter(pk__in=discussion_ids).update(
+            recipients_count=count(Recipient), messages_count=count(Message)
+        )
+
+    def adjust_recipients_count(self, deltas):
+        """
+        Reconciles ``recipients_count`` of discussions which gained
+        or lost recipients.
+
+        In incremental mode, discussions sharing the same delta are updated
+        with a single query, they are recounted otherwise.
+
+        :param deltas:
+            A dict of discussion ids to the number of added recipients,
+            negative when they were removed.
+
+        """
+        if not settings.INCREMENTAL_COUNTERS:
+            return self.update_counters(list(deltas))
+
+        discussion_ids_by_delta = defaultdict(list)
+
+        for discussion_id, delta in deltas.items():
+            if delta:
+                discussion_ids_by_delta[delta].append(discussion_id)
+
+        for delta, discussion_ids in discussion_ids_by_delta.items():
+            self.filter(pk__in=discussion_ids).update(
+                recipients_count=F("recipients_count") + delta
+            )
+
+    def refresh_latest_messages(self, discussion_ids):
+        """
+        Recompute the latest message snapshot of ``discussion_ids`` from
+        their messages, to backfill discussions saved before it was
+        denormalized.
+
+        """
+        from .models import Message
+
+        latest = (
+            Message.objects.filter(discussion=OuterRef("pk"))
+            .order_by("-sent_at", "-pk")
+            .values("pk")[:1]
+        )
+
+        message_ids = (
+            self.filter(pk__in=discussion_ids)
+            .annotate(latest_message_pk=Subquery(latest))
+            .exclude(latest_message_pk=None)
+            .values_list("latest_message_pk", flat=True)
+        )
+
+        discussions = []
+
+        for message in Message.objects.filter(pk__in=list(message_ids)).only(
+            "discussion", "sender", "body"
+        ):
+            discussion = self.model(pk=message.discussion_id)
+            discussion.set_latest_message(message)
+            discussions.append(discussion)
+
+        if not discussions:
+            return
+
+        def case(attname):
+            return Case(
+                *[
+                    When(pk=discussion.pk, then=Value(getattr(discussion, attname)))
+                    for discussion in discussions
+                ]
+            )
+
+        self.filter(pk__in=[discussion.pk for discussion in discussions]).update(
+            latest_message=case("latest_message_id"),
+            latest_message_excerpt=case("latest_message_excerpt"),
+            latest_message_sender=case("latest_message_sender_id"),
+        )
+
+    def refresh_participants_snapshots(self, discussion_ids):
+        """
+        Rebuild the participants snapshot of ``discussion_ids`` from
+        their recipients, see :meth:`Discussion.refresh_participants_snapshot`.
+
+        """
+        snapshots = {}
+
+        for discussion in self.filter(pk__in=discussion_ids).only("pk"):
+            discussion.refresh_participants_snapshot(commit=False)
+            snapshots[discussion.pk] = discussion.participants_snapshot
+
+        if snapshots:
+            self.filter(pk__in=list(snapshots)).update(
+                participants_snapshot=Case(
+                    *[
+                        When(pk=pk, then=Value(snapshot))
+                        for pk, snapshot in snapshots.items()
+                    ]
+                )
+            )
+
+    def get_for_user(self, pk, user, queryset=None):
         """
-        discussion = self.model(sender=sender, subject=subject)
-        discussion.save()
+        Returns the discussion ``pk`` with its sender and the recipient of
+        ``user`` preloaded, ``can_view`` and ``is_recipient`` are then
+        answered without querying.
 
-        discussion.save_recipients(list(to_user_list) + [sender])
+        The recipient and its discussion are fetched with a single query,
+        the discussion alone is fetched when ``user`` is not a recipient.
 
-        discussion.add_message(body)
+        :param queryset:
+            The queryset of discussions to look ``pk`` up in, every
+            discussion when ``None``.
+
+        :raises DoesNotExist: when the discussion does not exist.
+
+        """
+        from .models import Recipient
+
+        if queryset is None:
+            queryset = self.all()
+
+        recipient = None
+
+        if user.is_authenticated:
+            recipients = Recipient.objects.filter(discussion=pk, user=user.pk)
+
+            if queryset.query.has_filters():
+                recipients = recipients.filter(
+                    discussion__in=queryset.filter(pk=pk).values("pk")
+                )
+
+            recipient = recipients.select_related("discussion__sender").first()
+
+        if recipient is None:
+            discussion = queryset.select_related("sender").get(pk=pk)
+        else:
+            discussion = recipient.discussion
+
+        discussion.set_recipient(user, recipient)
 
         return discussion
 
     def get_conversation_between(self, from_user, to_user):
-        """ Returns a conversation between two users """
-        messages = self.filter(
-            Q(sender=from_user, recipients=to_user, sender_deleted_at__isnull=True)
+        """
+        Returns discussions sent by one user to the other, which have not
+        been deleted by the user they are sent to, or by their sender.
+
+        """
+        return self.filter(
+            Q(
+                sender=from_user,
+                recipient__user=to_user,
+                sender_deleted_at__isnull=True,
+            )
             | Q(
                 sender=to_user,
-                recipients=from_user,
-                messagerecipient__deleted_at__isnull=True,
+                recipient__user=from_user,
+                recipient__deleted_at__isnull=True,
             )
-        )
-        return messages
+        ).distinct()
 
 
 class RecipientManager(models.Manager):
     """ Manager for the :class:`MessageRecipient` model. """
 
     def contribute_to_class(self, cls, name):
+        signals.pre_save.connect(self.handle_pre_save, sender=cls)
         signals.post_save.connect(self.handle_post_save, sender=cls)
         signals.post_delete.connect(self.handle_post_delete, sender=cls)
         return super(RecipientManager, self).contribute_to_class(cls, name)
 
+    def handle_pre_save(self, instance, **kwargs):
+        if instance._state.adding and not kwargs.get("raw", False):
+            discussion = instance.discussion
+
+            instance.is_sender = discussion.sender_id == instance.user_id
+            instance.last_activity_at = discussion.updated_at or discussion.created_at
+
     def handle_post_save(self, instance, **kwargs):
         if kwargs.get("created", False):
+            from .models import InboxStats
+
+            InboxStats.objects.record_created([(instance.user_id, instance.status)])
+
             discussion = instance.discussion
-            discussion.update_counters()
+
+            cache.bump_generations([instance.user_id])
+
+            if not discussion.is_broadcast():
+                cache.bump_discussion_generations([discussion.pk])
+
+            discussion.add_to_participants_snapshot([instance.user])
+
+            if settings.INCREMENTAL_COUNTERS and not kwargs.get("raw", False):
+                discussion.increment_counters(recipients=1)
+            else:
+                discussion.update_counters()
 
     def handle_post_delete(self, instance, **kwargs):
+        from .models import InboxStats
+
+        if instance.pk in getattr(_deleting, "pks", ()):
+            return
+
+        InboxStats.objects.record_deleted([(instance.user_id, instance.status)])
+
+        cache.bump_generations([instance.user_id])
+
         try:
-            instance.discussion.update_counters()
+            discussion = instance.discussion
         except ObjectDoesNotExist:
-            pass
+            return
+
+        if discussion.pair_key:
+            discussion.clear_pair_key()
+
+        if not discussion.is_broadcast():
+            cache.bump_discussion_generations([discussion.pk])
+
+        discussion.remove_from_participants_snapshot(set([instance.user_id]))
+
+        if settings.INCREMENTAL_COUNTERS:
+            discussion.increment_counters(recipients=-1)
+        else:
+            discussion.update_counters()
+
+    def insert_missing(self, recipients, checked=False):
+        """
+        Insert ``recipients`` with a single INSERT, skipping those whose
+        user already takes part in their discussion.
+
+        An insertion racing with another one of the same rows fails on the
+        unique constraint on ``(user, discussion)``, it is retried without
+        the rows inserted meanwhile.
+
+        :param recipients:
+            A list of unsaved :class:`Recipient`.
+
+        :param checked:
+            Whether ``recipients`` are known to be missing, they are not
+            looked up before the first attempt then.
+
+        :return:
+            The list of inserted recipients, to reconcile counters with.
+
+        """
+        for attempt in range(INSERT_RETRIES):
+            if attempt or not checked:
+                existing = set(
+                    self.filter(
+                        discussion__in=set(r.discussion_id for r in recipients),
+                        user__in=set(r.user_id for r in recipients),
+                    ).values_list("user_id", "discussion_id")
+                )
+
+                recipients = [
+                    r for r in recipients if (r.user_id, r.discussion_id) not in existing
+                ]
+
+            if not recipients:
+                return []
+
+            try:
+                with transaction.atomic():
+                    return self.bulk_create(recipients)
+            except IntegrityError:
+                if attempt == INSERT_RETRIES - 1:
+                    raise
+
+    def add_participants(self, discussion, users, commit=True):
+        """
+        Add ``users`` to ``discussion`` with a single INSERT, users who
+        already take part in it are skipped, see :meth:`insert_missing`.
+
+        :param discussion:
+            The :class:`Discussion` to add users to.
+
+        :param users:
+            A list which elements are :class:`User`.
+
+        :param commit:
+            Whether counters and the participants snapshot should be saved,
+            pass ``False`` for a new discussion whose counters will be saved
+            afterwards anyway: current participants are not looked up then.
+
+        :return:
+            The list of added users.
+
+        """
+        from .models import InboxStats
+
+        users = list(OrderedDict((user.pk, user) for user in users).values())
+
+        last_activity_at = discussion.updated_at or discussion.created_at
+
+        recipients = self.insert_missing(
+            [
+                self.model(
+                    user=user,
+                    discussion=discussion,
+                    is_sender=user.pk == discussion.sender_id,
+                    last_activity_at=last_activity_at,
+                )
+                for user in users
+            ],
+            checked=not commit,
+        )
+
+        if not recipients:
+            return []
+
+        users = [recipient.user for recipient in recipients]
+
+        discussion.__dict__.pop("_recipients_by_user", None)
+
+        # Readers of a broadcast are not shown to each other, rows of
+        # other participants change otherwise
+        if not discussion.is_broadcast():
+            discussion.add_to_participants_snapshot(users, commit=commit)
+
+            cache.bump_discussion_generations([discussion.pk])
+
+        user_ids = set(user.pk for user in users)
+
+        if discussion.pair_key and not user_ids.issubset(
+            discussion.get_pair_user_ids()
+        ):
+            discussion.clear_pair_key()
+
+        InboxStats.objects.record_created(
+            [(user.pk, self.model.STATUS.unread) for user in users]
+        )
+
+        cache.bump_generations(user_ids)
+
+        if commit:
+            if settings.INCREMENTAL_COUNTERS:
+                discussion.increment_counters(recipients=len(users))
+            else:
+                discussion.update_counters()
+
+        return users
+
+    def get_pending(self, user):
+        """
+        Returns unsaved unread recipients of ``user`` for the broadcasts
+        they have no recipient for yet, to be merged into their inbox.
+
+        """
+        from .models import Discussion
+
+        return [
+            self.model(
+                user=user,
+                discussion=discussion,
+                last_activity_at=discussion.updated_at or discussion.created_at,
+            )
+            for discussion in Discussion.objects.get_pending_broadcasts(user)[
+                : settings.BROADCASTS_PENDING_LIMIT
+            ]
+        ]
+
+    def save_pending(self, user, discussion_ids=None):
+        """
+        Save recipients of ``user`` for the broadcasts they have no
+        recipient for yet with a single INSERT, before their status is
+        changed.
+
+        :param discussion_ids:
+            Ids of the broadcasts to save recipients for, every pending
+            broadcast of the user when ``None``.
+
+        :return:
+            The number of saved recipients.
+
+        """
+        from .models import Discussion, InboxStats
+
+        discussions = Discussion.objects.get_pending_broadcasts(user)
+
+        if discussion_ids is not None:
+            discussions = discussions.filter(pk__in=discussion_ids)
+
+        discussions = list(
+            discussions.only("created_at", "updated_at")[
+                : settings.BROADCASTS_PENDING_LIMIT
+            ]
+        )
+
+        if not discussions:
+            return 0
+
+        # Pending broadcasts have no recipient for the user, unless it is
+        # being saved concurrently
+        recipients = self.insert_missing(
+            [
+                self.model(
+                    user=user,
+                    discussion=discussion,
+                    last_activity_at=discussion.updated_at or discussion.created_at,
+                )
+                for discussion in discussions
+            ],
+            checked=True,
+        )
+
+        if not recipients:
+            return 0
+
+        Discussion.objects.adjust_recipients_count(
+            dict((recipient.discussion_id, 1) for recipient in recipients)
+        )
+
+        InboxStats.objects.record_created(
+            [(user.pk, self.model.STATUS.unread) for recipient in recipients]
+        )
+
+        cache.bump_generations([user.pk])
+
+        return len(recipients)
+
+    def remove_participants(self, discussion, users):
+        """
+        Remove ``users`` from ``discussion`` with a single DELETE, see
+        :meth:`delete_recipients`. The sender of the discussion stays.
+
+        :param users:
+            A list which elements are :class:`User` or their ids.
+
+        :return:
+            The number of removed users.
+
+        """
+        user_ids = [getattr(user, "pk", user) for user in users]
+
+        count = self.delete_recipients(
+            self.filter(discussion=discussion.pk, user__in=user_ids).exclude(
+                user=discussion.sender_id
+            )
+        )
+
+        discussion.__dict__.pop("_recipients_by_user", None)
+
+        return count
+
+    def delete_recipients(self, queryset):
+        """
+        Delete every recipient of ``queryset``, discussion counters and
+        inbox stats are reconciled once for the whole batch instead of
+        once per recipient.
+
+        Deletion signals are still sent, the handlers of this manager
+        skip recipients of the batch.
+
+        :param queryset:
+            A queryset of :class:`Recipient`.
+
+        :return:
+            The number of deleted recipients.
+
+        """
+        from .models import Discussion, InboxStats
+
+        rows = list(queryset.values_list("pk", "user_id", "status", "discussion_id"))
+
+        if not rows:
+            return 0
+
+        pks = [row[0] for row in rows]
+
+        _deleting.pks = set(pks)
+
+        try:
+            self.filter(pk__in=pks).delete()
+        finally:
+            _deleting.pks = ()
+
+        deltas = defaultdict(int)
+        user_ids = defaultdict(set)
+
+        for pk, user_id, status, discussion_id in rows:
+            deltas[discussion_id] -= 1
+            user_ids[discussion_id].add(user_id)
+
+        Discussion.objects.adjust_recipients_count(deltas)
+
+        # Snapshots containing removed participants are updated at once
+        snapshots = {}
+        pairs = []
+        changed = []
+
+        for discussion in Discussion.objects.filter(pk__in=list(deltas)).only(
+            "participants_snapshot", "pair_key", "audience"
+        ):
+            if not discussion.is_broadcast():
+                changed.append(discussion.pk)
+
+            if discussion.remove_from_participants_snapshot(
+                user_ids[discussion.pk], commit=False
+            ):
+                snapshots[discussion.pk] = discussion.participants_snapshot
+
+            if discussion.pair_key:
+                pairs.append(discussion.pk)
+
+        # Direct discussions which lost a participant are not canonical anymore
+        if pairs:
+            Discussion.objects.filter(pk__in=pairs).update(pair_key=None)
+
+        if snapshots:
+            Discussion.objects.filter(pk__in=list(snapshots)).update(
+                participants_snapshot=Case(
+                    *[
+                        When(pk=pk, then=Value(snapshot))
+                        for pk, snapshot in snapshots.items()
+                    ]
+                )
+            )
+
+        InboxStats.objects.record_deleted(
+            [(user_id, status) for pk, user_id, status, discussion_id in rows]
+        )
+
+        cache.bump_generations([user_id for pk, user_id, status, discussion_id in rows])
+
+        # Remaining participants see the new membership
+        cache.bump_discussion_generations(changed)
+
+        return len(rows)
+
+    def refresh_sort_keys(self, discussion_ids):
+        """
+        Recompute ``is_sender`` and ``last_activity_at`` of every recipient
+        of ``discussion_ids`` from their discussion, to backfill rows
+        saved before they were denormalized.
+
+        """
+        from .models import Discussion
+
+        recipients = self.filter(discussion__in=discussion_ids)
+
+        recipients.update(
+            last_activity_at=Subquery(
+                Discussion.objects.filter(pk=OuterRef("discussion_id"))
+                .annotate(activity=Coalesce("updated_at", "created_at"))
+                .values("activity")[:1]
+            )
+        )
+
+        recipients.exclude(discussion__sender=F("user")).update(is_sender=False)
+        recipients.filter(discussion__sender=F("user")).update(is_sender=True)
+
+    def get_status_filter(self, status):
+        """
+        Returns a ``Q`` object matching recipients in ``status``.
+
+        With sequence read tracking, read recipients which are behind the
+        sequence of their discussion have new messages and are unread.
+
+        """
+        STATUS = self.model.STATUS
+
+        if not settings.SEQUENCE_READ_TRACKING or status == STATUS.deleted:
+            return Q(status=status)
+
+        if status == STATUS.unread:
+            return Q(status=STATUS.unread) | Q(
+                status=STATUS.read, discussion__last_seq__gt=F("last_read_seq")
+            )
+
+        return Q(status=STATUS.read, discussion__last_seq__lte=F("last_read_seq"))
+
+    def get_last_seq_subquery(self):
+        """ Returns the sequence of the discussion of a recipient """
+        from .models import Discussion
+
+        return Subquery(
+            Discussion.objects.filter(pk=OuterRef("discussion_id")).values("last_seq")[
+                :1
+            ]
+        )
+
+    def update_status(self, queryset, status, **kwargs):
+        """
+        Change the status of every recipient of ``queryset`` with a single
+        UPDATE and keep inbox stats of their users in sync.
+
+        With sequence read tracking, recipients marked as read catch up
+        with the sequence of their discussion.
+
+        :param queryset:
+            A queryset of :class:`Recipient`.
+
+        :param status:
+            The new status, one of ``Recipient.STATUS``.
+
+        :return:
+            The number of updated recipients.
+
+        """
+        from .models import InboxStats
+
+        queryset = queryset.exclude(self.get_status_filter(status))
+
+        if settings.SEQUENCE_READ_TRACKING and status == self.model.STATUS.read:
+            kwargs.setdefault("last_read_seq", self.get_last_seq_subquery())
+
+        rows = list(queryset.values_list("user_id", "status"))
+
+        if not rows:
+            return 0
+
+        count = queryset.update(status=status, **kwargs)
+
+        InboxStats.objects.record_transition(rows, status)
+
+        cache.bump_generations([user_id for user_id, previous_status in rows])
+
+        return count
+
+    def get_inbox_version(self, user):
+        """
+        Returns the version of everything shown in the inbox of ``user``,
+        changed by :func:`cache.bump_generations` and by a bump of the
+        generation of any of their discussions.
+
+        New messages only bump their discussion: ids of the discussions of
+        the user are cached under their generation, which moves with their
+        memberships, and generations of these discussions are read at once.
+
+        """
+        generation = cache.get_generation(user.pk)
+
+        backend = cache.get_cache()
+        key = cache.inbox_key(user.pk, generation)
+
+        discussion_ids = backend.get(key)
+
+        if discussion_ids is None:
+            discussion_ids = list(
+                self.filter(user=user)
+                .order_by("discussion_id")
+                .values_list("discussion_id", flat=True)
+            )
+
+            backend.set(key, discussion_ids, None)
+
+        generations = cache.get_discussion_generations(discussion_ids)
+
+        value = ",".join(
+            "%s-%s" % (discussion_id, generations[discussion_id])
+            for discussion_id in discussion_ids
+        )
+
+        return "%s-%s" % (generation, hashlib.md5(value.encode("utf-8")).hexdigest())
 
     def count_unread_messages_for(self, user):
         """
@@ -75,9 +913,30 @@ class RecipientManager(models.Manager):
             An integer with the amount of unread messages.
 
         """
-        unread_total = self.filter(user=user, status=self.model.STATUS.unread).count()
+        from .models import Discussion, InboxStats
+
+        def compute():
+            # Pending broadcasts are unread
+            count = Discussion.objects.get_pending_broadcasts(user)[
+                : settings.BROADCASTS_PENDING_LIMIT
+            ].count()
+
+            if settings.SEQUENCE_READ_TRACKING:
+                # Stats only know about statuses, not about sequences
+                return count + self.filter(
+                    self.get_status_filter(self.model.STATUS.unread), user=user
+                ).count()
 
-        return unread_total
+            return count + InboxStats.objects.get_for_user(user).unread_count
+
+        if settings.COUNTERS_CACHE_TIMEOUT is None:
+            return compute()
+
+        return cache.get_or_compute(
+            cache.unread_count_key(user.pk, self.get_inbox_version(user)),
+            compute,
+            settings.COUNTERS_CACHE_TIMEOUT,
+        )
 
     def count_unread_messages_between(self, to_user, from_user):
         """
@@ -93,11 +952,30 @@ class RecipientManager(models.Manager):
             An integer with the amount of unread messages.
 
         """
-        unread_total = self.filter(
-            discussion__sender=from_user, user=to_user, status=self.model.STATUS.unread
-        ).count()
+        from .models import Discussion
 
-        return unread_total
+        def compute():
+            return (
+                self.filter(
+                    self.get_status_filter(self.model.STATUS.unread),
+                    discussion__sender=from_user,
+                    user=to_user,
+                ).count()
+                + Discussion.objects.get_pending_broadcasts(to_user)
+                .filter(sender=from_user)[: settings.BROADCASTS_PENDING_LIMIT]
+                .count()
+            )
+
+        if settings.COUNTERS_CACHE_TIMEOUT is None:
+            return compute()
+
+        return cache.get_or_compute(
+            cache.unread_between_key(
+                to_user.pk, from_user.pk, self.get_inbox_version(to_user)
+            ),
+            compute,
+            settings.COUNTERS_CACHE_TIMEOUT,
+        )
 
 
 class MessageManager(models.Manager):
@@ -109,11 +987,143 @@ class MessageManager(models.Manager):
     def post_save(self, instance, **kwargs):
         if kwargs.get("created", False):
             discussion = instance.discussion
-            discussion.latest_message = instance
-            discussion.update_counters()
+            discussion.set_latest_message(instance)
+
+            if settings.INCREMENTAL_COUNTERS and not kwargs.get("raw", False):
+                discussion.increment_counters(messages=1)
+            else:
+                discussion.update_counters()
+
+            if not kwargs.get("raw", False):
+                search.index_message(instance)
 
     def post_delete(self, instance, **kwargs):
+        search.delete_message(instance)
+
         try:
-            instance.discussion.update_counters()
+            discussion = instance.discussion
         except ObjectDoesNotExist:
-            pass
+            return
+
+        if settings.INCREMENTAL_COUNTERS:
+            discussion.increment_counters(messages=-1)
+        else:
+            discussion.update_counters()
+
+
+class InboxStatsManager(models.Manager):
+    """ Manager for the :class:`InboxStats` model. """
+
+    def get_status_fields(self):
+        from .models import Recipient
+
+        return {
+            Recipient.STATUS.read: "read_count",
+            Recipient.STATUS.unread: "unread_count",
+            Recipient.STATUS.deleted: "deleted_count",
+        }
+
+    def get_for_user(self, user):
+        """
+        Returns the stats of a user, computing them the first time.
+
+        :param user:
+            A Django :class:`User`
+
+        """
+        try:
+            return self.get(pk=user.pk)
+        except self.model.DoesNotExist:
+            return self.recompute(user)
+
+    def recompute(self, user):
+        """ Rebuild the stats of a user from the recipient table """
+        from .models import Recipient
+
+        counts = dict(
+            Recipient.objects.filter(user_id=user.pk)
+            .order_by()
+            .values_list("status")
+            .annotate(count=Count("pk"))
+        )
+
+        defaults = {"total_count": sum(counts.values())}
+
+        for status, field_name in self.get_status_fields().items():
+            defaults[field_name] = counts.get(status, 0)
+
+        stats, created = self.update_or_create(pk=user.pk, defaults=defaults)
+
+        return stats
+
+    def adjust(self, deltas):
+        """
+        Apply increments to stats, users sharing the same increments
+        are updated with a single query.
+
+        Stats which have not been computed yet are left untouched.
+
+        :param deltas:
+            A dict of user ids to dicts of field names and increments.
+
+        """
+        user_ids_by_delta = defaultdict(list)
+
+        for user_id, delta in deltas.items():
+            delta = tuple(sorted((name, value) for name, value in delta.items() if value))
+
+            if delta:
+                user_ids_by_delta[delta].append(user_id)
+
+        for delta, user_ids in user_ids_by_delta.items():
+            self.filter(pk__in=user_ids).update(
+                **dict((name, F(name) + value) for name, value in delta)
+            )
+
+    def _record(self, rows, value):
+        fields = self.get_status_fields()
+        deltas = defaultdict(lambda: defaultdict(int))
+
+        for user_id, status in rows:
+            deltas[user_id][fields[status]] += value
+            deltas[user_id]["total_count"] += value
+
+        self.adjust(deltas)
+
+    def record_created(self, rows):
+        """
+        Count new recipients.
+
+        :param rows:
+            An iterable of ``(user_id, status)`` of the created recipients.
+
+        """
+        self._record(rows, 1)
+
+    def record_deleted(self, rows):
+        """
+        Discount deleted recipients.
+
+        :param rows:
+            An iterable of ``(user_id, status)`` of the deleted recipients.
+
+        """
+        self._record(rows, -1)
+
+    def record_transition(self, rows, status):
+        """
+        Move recipients from their previous status to ``status``.
+
+        :param rows:
+            An iterable of ``(user_id, previous_status)`` of the updated
+            recipients.
+
+        """
+        fields = self.get_status_fields()
+        deltas = defaultdict(lambda: defaultdict(int))
+
+        for user_id, previous_status in rows:
+            deltas[user_id][fields[previous_status]] -= 1
+            deltas[user_id][fields[status]] += 1
+
+        self.adjust(deltas)
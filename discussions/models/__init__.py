@@ -9,3 +9,5 @@ Message = load_class(settings.MESSAGE_MODEL)
 Folder = load_class(settings.FOLDER_MODEL)
 
 Discussion = load_class(settings.DISCUSSION_MODEL)
+
+InboxStats = load_class(settings.INBOX_STATS_MODEL)
@@ -1,14 +1,27 @@
+import hashlib
+import json
+
+import six
+
 from django.db import models
+from django.db.models import F
 from django.conf import settings
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.text import Truncator
 
-from discussions.managers import DiscussionManager, RecipientManager, MessageManager
+from discussions.managers import (
+    DiscussionManager,
+    RecipientManager,
+    MessageManager,
+    InboxStatsManager,
+)
 
 from django.utils.timezone import now as tznow
 
 from ..utils import get_model_string
+from .. import cache, settings as defaults
 
 from model_utils import Choices
 
@@ -55,6 +68,15 @@ class Recipient(models.Model):
         choices=STATUS, default=STATUS.unread, verbose_name=_("Status"), db_index=True
     )
 
+    # Denormalized from the discussion so that inbox queries
+    # are served by the indexes below without joining it
+    last_activity_at = models.DateTimeField(_("last activity at"), default=tznow)
+
+    is_sender = models.BooleanField(_("is sender"), default=False)
+
+    # Sequence of the latest message read, with sequence read tracking
+    last_read_seq = models.PositiveIntegerField(_("last read sequence"), default=0)
+
     objects = RecipientManager()
 
     class Meta:
@@ -62,41 +84,87 @@ class Recipient(models.Model):
         verbose_name_plural = _("recipients")
         app_label = "discussions"
         abstract = True
+        indexes = [
+            models.Index(
+                fields=["user", "folder", "last_activity_at"],
+                name="discussions_recipient_inbox",
+            ),
+            models.Index(
+                fields=["user", "status", "folder", "last_activity_at"],
+                name="discussions_recipient_status",
+            ),
+            models.Index(
+                fields=["user", "is_sender", "folder", "last_activity_at"],
+                name="discussions_recipient_sent",
+            ),
+        ]
+        unique_together = (("user", "discussion"),)
 
     def __str__(self):
         return _("%(discussion)s") % {"discussion": self.discussion}
 
+    def count_new_messages(self):
+        """
+        Returns the number of messages posted since the recipient last read
+        the discussion, always ``0`` without sequence read tracking.
+
+        """
+        if not defaults.SEQUENCE_READ_TRACKING:
+            return 0
+
+        return max(self.discussion.last_seq - self.last_read_seq, 0)
+
     def is_read(self):
         """ Returns a boolean whether the recipient has read the message """
-        return self.status == self.STATUS.read
+        return self.status == self.STATUS.read and not self.count_new_messages()
 
     def is_unread(self):
         """ Returns a boolean whether the recipient hasn't read the message """
-        return self.status == self.STATUS.unread
+        return self.status == self.STATUS.unread or (
+            self.status == self.STATUS.read and self.count_new_messages() > 0
+        )
 
     def is_deleted(self):
         """ Returns a boolean whether the recipient has deleted the message """
         return self.status == self.STATUS.deleted
 
-    def mark_as_deleted(self, commit=True):
-        self.deleted_at = tznow()
-        self.status = self.STATUS.deleted
+    def set_status(self, status, commit=True):
+        """
+        Change the status of the recipient, inbox stats of the user are
+        only updated when ``commit`` is ``True``.
+
+        """
+        from . import InboxStats
+
+        previous_status, self.status = self.status, status
 
         if commit:
-            self.save()
+            # Other columns may have been changed concurrently
+            self.save(
+                update_fields=("status", "read_at", "deleted_at", "last_read_seq")
+            )
+
+            if previous_status != status:
+                InboxStats.objects.record_transition(
+                    [(self.user_id, previous_status)], status
+                )
+
+            cache.bump_generations([self.user_id])
+
+    def mark_as_deleted(self, commit=True):
+        self.deleted_at = tznow()
+        self.set_status(self.STATUS.deleted, commit=commit)
 
     def mark_as_read(self, commit=True):
         self.read_at = tznow()
-        self.status = self.STATUS.read
 
-        if commit:
-            self.save()
+        if defaults.SEQUENCE_READ_TRACKING:
+            self.last_read_seq = self.discussion.last_seq
 
-    def mark_as_unread(self, commit=True):
-        self.status = self.STATUS.unread
+        self.set_status(self.STATUS.read, commit=commit)
 
-        if commit:
-            self.save()
+    def mark_as_unread(self, commit=True):
+        self.set_status(self.STATUS.unread, commit=commit)
 
 
 @python_2_unicode_compatible
@@ -133,12 +201,46 @@ class Discussion(models.Model):
         related_name="latest_discussions",
     )
 
+    # Snapshot of the latest message, rendered in the inbox
+    # without loading the message itself
+    latest_message_excerpt = models.CharField(
+        _("latest message excerpt"), max_length=255, blank=True, default=""
+    )
+
+    latest_message_sender = models.ForeignKey(
+        AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_("latest message sender"),
+    )
+
     subject = models.CharField(max_length=255)
 
+    # Sorted ids of both participants of the canonical direct discussion
+    # between two users, empty for other discussions
+    pair_key = models.CharField(
+        _("pair key"), max_length=64, null=True, blank=True, unique=True
+    )
+
+    # Key of the audience of a broadcast discussion, empty for other
+    # discussions: recipients of a broadcast are saved once they act on it
+    audience = models.CharField(_("audience"), max_length=100, null=True, blank=True)
+
     recipients_count = models.PositiveIntegerField(default=0, null=True, blank=True)
 
     messages_count = models.PositiveIntegerField(default=0, null=True, blank=True)
 
+    # JSON list of ``[id, name]`` of the first participants, rendered in
+    # the inbox without loading the whole membership
+    participants_snapshot = models.TextField(
+        _("participants snapshot"), blank=True, default=""
+    )
+
+    # Incremented on each message with sequence read tracking
+    last_seq = models.PositiveIntegerField(_("last sequence"), default=0)
+
     objects = DiscussionManager()
 
     class Meta:
@@ -148,53 +250,283 @@ class Discussion(models.Model):
         permissions = (("can_view", "Can view"),)
         app_label = "discussions"
         abstract = True
+        indexes = [
+            # Recent broadcasts of the audiences of a user
+            models.Index(
+                fields=["audience", "updated_at"], name="discussions_broadcast"
+            )
+        ]
 
     def __str__(self):
         return self.subject
 
+    def get_version(self):
+        """
+        Returns a fingerprint of the displayed state of the discussion,
+        which changes with new messages and participants.
+
+        """
+        value = "%s:%s:%s:%s" % (
+            self.updated_at.isoformat() if self.updated_at else "",
+            self.messages_count,
+            self.participants_snapshot,
+            # Readers of a broadcast are not displayed
+            "" if self.is_broadcast() else self.recipients_count,
+        )
+
+        return hashlib.md5(value.encode("utf-8")).hexdigest()
+
     def update_counters(self, commit=True):
+        """
+        Recount recipients and messages of this discussion.
+
+        In incremental mode (``DISCUSSIONS_INCREMENTAL_COUNTERS``) this is
+        only called on explicit request, to fix counters which have drifted.
+
+        """
         self.recipients_count = self.recipients.count()
         self.messages_count = self.messages.count()
 
         if commit:
             self.save(update_fields=("recipients_count", "messages_count"))
 
-    def save_recipients(self, to_user_list):
+    def increment_counters(self, recipients=0, messages=0):
+        """
+        Atomically shift counters of this discussion without recounting,
+        negative values decrement them.
+
+        """
+        updates = {}
+
+        if recipients:
+            updates["recipients_count"] = F("recipients_count") + recipients
+            self.recipients_count = (self.recipients_count or 0) + recipients
+
+        if messages:
+            updates["messages_count"] = F("messages_count") + messages
+            self.messages_count = (self.messages_count or 0) + messages
+
+        if updates:
+            self.__class__.objects.filter(pk=self.pk).update(**updates)
+
+    def get_participants(self):
+        """
+        Returns the first participants of the discussion from the snapshot,
+        as dicts with their ``id`` and ``name``.
+
+        """
+        if not self.participants_snapshot:
+            return []
+
+        return [
+            {"id": user_id, "name": name}
+            for user_id, name in json.loads(self.participants_snapshot)
+        ]
+
+    def count_hidden_participants(self):
+        """ Returns the number of participants missing from the snapshot """
+        return max((self.recipients_count or 0) - len(self.get_participants()), 0)
+
+    def _save_participants_snapshot(self, participants, commit):
+        self.participants_snapshot = json.dumps(
+            [[participant["id"], participant["name"]] for participant in participants]
+        )
+
+        if commit:
+            self.__class__.objects.filter(pk=self.pk).update(
+                participants_snapshot=self.participants_snapshot
+            )
+
+    def add_to_participants_snapshot(self, users, commit=True):
+        """
+        Add ``users`` to the participants snapshot while it is not full,
+        nothing is written when it does not change.
+
+        """
+        participants = self.get_participants()
+        user_ids = set(participant["id"] for participant in participants)
+        changed = False
+
+        for user in users:
+            if len(participants) >= defaults.PARTICIPANTS_SNAPSHOT_SIZE:
+                break
+
+            if user.pk not in user_ids:
+                user_ids.add(user.pk)
+                participants.append({"id": user.pk, "name": six.text_type(user)})
+                changed = True
+
+        if changed:
+            self._save_participants_snapshot(participants, commit)
+
+    def remove_from_participants_snapshot(self, user_ids, commit=True):
+        """
+        Remove users from the participants snapshot, it is refilled
+        as new participants join.
+
+        :return:
+            Boolean indicating if the snapshot has changed.
+
+        """
+        participants = self.get_participants()
+        remaining = [p for p in participants if p["id"] not in user_ids]
+
+        if len(remaining) == len(participants):
+            return False
+
+        self._save_participants_snapshot(remaining, commit)
+
+        return True
+
+    def refresh_participants_snapshot(self, commit=True):
+        """ Rebuild the participants snapshot from recipients """
         from . import Recipient
 
+        recipients = (
+            Recipient.objects.filter(discussion=self.pk)
+            .select_related("user")
+            .order_by("pk")[: defaults.PARTICIPANTS_SNAPSHOT_SIZE]
+        )
+
+        self._save_participants_snapshot(
+            [
+                {"id": recipient.user_id, "name": six.text_type(recipient.user)}
+                for recipient in recipients
+            ],
+            commit,
+        )
+
+    def save_recipients(self, to_user_list, commit=True):
         """
         Save the recipients for this message
 
+        Recipients are inserted with a single query, users appearing more
+        than once in ``to_user_list`` or already recipients are only saved
+        once, see :meth:`RecipientManager.add_participants`.
+
         :param to_user_list:
             A list which elements are :class:`User` to whom the message is for.
 
+        :param commit:
+            Whether counters and the participants snapshot should be
+            saved, pass ``False`` when they will be saved afterwards anyway.
+
         :return:
             Boolean indicating if any users are saved.
 
         """
-        created = False
-        for user in to_user_list:
-            Recipient.objects.create(user=user, discussion=self)
-            created = True
-        return created
+        from . import Recipient
+
+        return bool(
+            Recipient.objects.add_participants(self, to_user_list, commit=commit)
+        )
+
+    def get_recipient(self, user):
+        """
+        Returns the :class:`Recipient` of ``user`` in this discussion or
+        ``None``, it is only loaded once per instance.
+
+        """
+        from . import Recipient
+
+        recipients = self.__dict__.get("_recipients_by_user", {})
+
+        if user.pk not in recipients:
+            self.set_recipient(
+                user,
+                Recipient.objects.filter(discussion=self.pk, user=user.pk).first(),
+            )
+
+        return self.__dict__["_recipients_by_user"][user.pk]
+
+    def set_recipient(self, user, recipient):
+        """
+        Caches ``recipient``, the :class:`Recipient` of ``user`` or ``None``
+        when they are not a recipient, for :meth:`get_recipient`.
+
+        """
+        if recipient is not None:
+            recipient.discussion = self
+
+        self.__dict__.setdefault("_recipients_by_user", {})[user.pk] = recipient
+
+    def get_pair_user_ids(self):
+        if not self.pair_key:
+            return set()
+
+        return set(int(user_id) for user_id in self.pair_key.split(":"))
+
+    def clear_pair_key(self):
+        """ Stops being the canonical direct discussion of its participants """
+        self.pair_key = None
+        self.__class__.objects.filter(pk=self.pk).update(pair_key=None)
 
     def is_recipient(self, user):
-        return user.pk in self.recipients.values_list("id", flat=True)
+        return self.get_recipient(user) is not None
+
+    def is_broadcast(self):
+        return self.audience is not None
+
+    def is_in_audience(self, user):
+        """
+        Returns a boolean whether ``user`` receives this broadcast, users
+        who joined after it was sent do not.
+
+        """
+        from .. import audiences
+
+        if not defaults.BROADCASTS or not self.is_broadcast():
+            return False
+
+        date_joined = getattr(user, "date_joined", None)
+
+        if date_joined is not None and date_joined > self.created_at:
+            return False
+
+        return audiences.contains(self.audience, user)
+
+    def get_or_create_recipient(self, user):
+        """
+        Returns the :class:`Recipient` of ``user``, it is saved first
+        when they are in the audience of this broadcast and have none yet.
+
+        """
+        from . import Recipient
+
+        recipient = self.get_recipient(user)
+
+        if (
+            recipient is None
+            and self.is_broadcast()
+            and Recipient.objects.save_pending(user, [self.pk])
+        ):
+            self.__dict__.pop("_recipients_by_user", None)
+
+            recipient = self.get_recipient(user)
+
+        return recipient
 
     def mark_as_read(self, user=None):
         from discussions.models import Recipient
 
-        recipients = self.recipients.all()
-
         recipients = Recipient.objects.filter(discussion_id=self.pk)
 
         if user:
             recipients = recipients.filter(user_id=user.pk)
 
-        recipients.update(read_at=tznow(), status=Recipient.STATUS.read)
+        Recipient.objects.update_status(
+            recipients, Recipient.STATUS.read, read_at=tznow()
+        )
+
+    def set_latest_message(self, message):
+        self.latest_message = message
+        self.latest_message_excerpt = Truncator(message.body).chars(
+            defaults.EXCERPT_LENGTH
+        )
+        self.latest_message_sender_id = message.sender_id
 
     def add_message(self, body, sender=None, commit=True):
-        from . import Message
+        from . import Message, Recipient
 
         if not sender:
             sender = self.sender
@@ -205,15 +537,54 @@ class Discussion(models.Model):
         if not self.is_recipient(sender):
             self.save_recipients([sender])
 
-        self.recipient_set.exclude(user=sender).update(status=Recipient.STATUS.unread)
-
         self.updated_at = tznow()
 
+        if defaults.SEQUENCE_READ_TRACKING:
+            # Recipients are left untouched, inboxes are sorted on the
+            # discussion and read the generation of the discussion
+            self.increment_seq(sender)
+        else:
+            self.recipient_set.update(last_activity_at=self.updated_at)
+
+            Recipient.objects.update_status(
+                self.recipient_set.exclude(user=sender), Recipient.STATUS.unread
+            )
+
         if commit:
-            self.save()
+            self.save(
+                update_fields=(
+                    "updated_at",
+                    "latest_message",
+                    "latest_message_excerpt",
+                    "latest_message_sender",
+                )
+            )
+
+        cache.bump_discussion_generations([self.pk])
+
+        if self.is_broadcast():
+            cache.bump_broadcasts_generation()
 
         return m
 
+    def increment_seq(self, sender):
+        """
+        Move the sequence of the discussion past a new message, which
+        ``sender`` has read.
+
+        Other recipients are left untouched: the message is unread for them
+        as long as their ``last_read_seq`` is behind the sequence.
+
+        """
+        from . import Recipient
+
+        self.__class__.objects.filter(pk=self.pk).update(last_seq=F("last_seq") + 1)
+        self.last_seq += 1
+
+        Recipient.objects.filter(discussion=self, user=sender).update(
+            last_read_seq=Recipient.objects.get_last_seq_subquery()
+        )
+
     def get_absolute_url(self):
         return reverse("discussions_detail", kwargs={"discussion_id": self.pk})
 
@@ -224,15 +595,18 @@ class Discussion(models.Model):
         if user.is_staff or user.is_superuser or self.is_recipient(user):
             return True
 
+        if self.is_in_audience(user):
+            return True
+
         return user.has_perm("discussions.can_view")
 
     def delete_recipient(self, user):
+        from . import Recipient
+
         if user.pk == self.sender_id:
             return False
 
-        self.recipients.through.objects.filter(
-            discussion=self.pk, user=user.pk
-        ).delete()
+        Recipient.objects.remove_participants(self, [user])
 
         return True
 
@@ -271,6 +645,11 @@ class Message(models.Model):
         verbose_name_plural = _("messages")
         app_label = "discussions"
         abstract = True
+        indexes = [
+            models.Index(
+                fields=["discussion", "sent_at"], name="discussions_message_sent"
+            )
+        ]
 
     def __str__(self):
         """ Human representation, displaying first ten words of the body. """
@@ -300,5 +679,51 @@ class Folder(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Folder, self).save(*args, **kwargs)
+
+        cache.bump_generations([self.user_id])
+
+    def delete(self, *args, **kwargs):
+        user_id = self.user_id
+
+        result = super(Folder, self).delete(*args, **kwargs)
+
+        cache.bump_generations([user_id])
+
+        return result
+
     def get_absolute_url(self):
         return reverse("discussions_folder_detail", kwargs={"folder_id": self.pk})
+
+
+class InboxStats(models.Model):
+    """
+    Denormalized recipient counters of a user, kept up to date when
+    recipients are created, deleted or change their status.
+
+    """
+
+    user = models.OneToOneField(
+        AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="discussions_stats",
+        verbose_name=_("user"),
+    )
+
+    unread_count = models.PositiveIntegerField(default=0)
+
+    read_count = models.PositiveIntegerField(default=0)
+
+    deleted_count = models.PositiveIntegerField(default=0)
+
+    total_count = models.PositiveIntegerField(default=0)
+
+    objects = InboxStatsManager()
+
+    class Meta:
+        verbose_name = _("inbox stats")
+        verbose_name_plural = _("inbox stats")
+        app_label = "discussions"
+        abstract = True
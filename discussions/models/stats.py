@@ -0,0 +1,10 @@
+from . import base
+
+from discussions.managers import InboxStatsManager
+
+
+class InboxStats(base.InboxStats):
+    class Meta(base.InboxStats.Meta):
+        abstract = False
+
+    objects = InboxStatsManager()
@@ -0,0 +1,306 @@
+import base64
+import binascii
+import json
+
+from functools import cmp_to_key
+
+import six
+
+from django.core.paginator import InvalidPage
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class KeysetOrdering(object):
+    """
+    Orders a queryset, along with a few extra objects missing from it
+    which are merged in memory.
+
+    :param ordering:
+        A list of field names, prefixed by ``-`` for descending order,
+        which must uniquely order the queryset (end it with ``pk``)
+        and reference non nullable values.
+
+    :param extra:
+        A list of ``(values, obj)`` of objects missing from the queryset,
+        ``values`` being their values for ``ordering``.
+
+    """
+
+    def __init__(self, queryset, ordering, extra=None):
+        self.queryset = queryset
+        self.ordering = [
+            (field.lstrip("-"), field.startswith("-")) for field in ordering
+        ]
+        self.extra = []
+
+        for values, obj in extra or []:
+            for index, value in enumerate(values):
+                setattr(obj, self.get_alias(index), value)
+
+            self.extra.append(obj)
+
+    def get_alias(self, index):
+        return "cursor_%d" % index
+
+    def get_values(self, obj):
+        return [
+            getattr(obj, self.get_alias(index)) for index in range(len(self.ordering))
+        ]
+
+    def get_queryset(self, reverse=False):
+        return self.queryset.annotate(
+            **dict(
+                (self.get_alias(index), F(field))
+                for index, (field, descending) in enumerate(self.ordering)
+            )
+        ).order_by(
+            *[
+                "%s%s" % ("-" if descending != reverse else "", self.get_alias(index))
+                for index, (field, descending) in enumerate(self.ordering)
+            ]
+        )
+
+    def compare_values(self, values, other_values, reverse=False):
+        """
+        Returns a negative number when ``values`` come before
+        ``other_values``, a positive one when they come after.
+
+        """
+        for (field, descending), value, other in zip(
+            self.ordering, values, other_values
+        ):
+            if value != other:
+                first = value > other if descending != reverse else value < other
+
+                return -1 if first else 1
+
+        return 0
+
+    def compare(self, obj, other, reverse=False):
+        return self.compare_values(
+            self.get_values(obj), self.get_values(other), reverse
+        )
+
+    def sort(self, objects, reverse=False):
+        return sorted(
+            objects, key=cmp_to_key(lambda obj, other: self.compare(obj, other, reverse))
+        )
+
+
+class CursorPaginator(KeysetOrdering):
+    """
+    Keyset paginator: pages are located by the ordering values of their
+    boundary objects instead of an offset, so any page costs the same as
+    the first one and no COUNT is needed.
+
+    See :class:`KeysetOrdering` for ``ordering`` and ``extra``.
+
+    """
+
+    def __init__(self, queryset, per_page, ordering, extra=None):
+        super(CursorPaginator, self).__init__(queryset, ordering, extra)
+
+        self.per_page = int(per_page)
+
+    def encode(self, obj, reverse=False):
+        data = json.dumps(
+            [self.get_values(obj), reverse], default=lambda value: value.isoformat()
+        )
+
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    def decode(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor.encode("ascii"))
+            values, reverse = json.loads(data.decode("utf-8"))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise InvalidCursor("Invalid cursor")
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor("Invalid cursor")
+
+        if not all(
+            isinstance(value, six.string_types + six.integer_types + (float,))
+            for value in values
+        ):
+            raise InvalidCursor("Invalid cursor")
+
+        return values, bool(reverse)
+
+    def get_filter(self, values, reverse):
+        """
+        Returns the condition selecting objects located after ``values``
+        or before them when ``reverse`` is ``True``.
+
+        """
+        condition = Q()
+        equals = {}
+
+        for index, ((field, descending), value) in enumerate(
+            zip(self.ordering, values)
+        ):
+            alias = self.get_alias(index)
+            lookup = "lt" if descending != reverse else "gt"
+
+            condition |= Q(**dict(equals, **{"%s__%s" % (alias, lookup): value}))
+
+            equals[alias] = value
+
+        return condition
+
+    def merge(self, object_list, values, reverse):
+        """
+        Merges extra objects located after ``values`` into ``object_list``,
+        the objects of the queryset located after them.
+
+        """
+        if not self.extra:
+            return object_list
+
+        if values is not None:
+            # Datetimes are encoded in cursors as strings
+            values = [
+                (parse_datetime(value) or value)
+                if isinstance(value, six.string_types)
+                else value
+                for value in values
+            ]
+
+        extra = [
+            obj
+            for obj in self.extra
+            if values is None
+            or self.compare_values(self.get_values(obj), values, reverse) > 0
+        ]
+
+        return self.sort(object_list + extra, reverse)
+
+    def page(self, cursor=None):
+        values, reverse = self.decode(cursor) if cursor else (None, False)
+
+        queryset = self.get_queryset(reverse)
+
+        if values is not None:
+            queryset = queryset.filter(self.get_filter(values, reverse))
+
+        object_list = self.merge(
+            list(queryset[: self.per_page + 1]), values, reverse
+        )
+
+        has_more = len(object_list) > self.per_page
+
+        object_list = object_list[: self.per_page]
+
+        if reverse:
+            object_list.reverse()
+
+            return CursorPage(object_list, self, has_next=True, has_previous=has_more)
+
+        return CursorPage(
+            object_list, self, has_next=has_more, has_previous=values is not None
+        )
+
+
+class MergedList(KeysetOrdering):
+    """
+    Objects of a queryset merged with a few extra objects, as a sequence
+    sliced by offset paginators.
+
+    A slice fetches the rows it covers plus one per extra object, whatever
+    its offset, extra objects being placed from the ordering values of
+    the fetched rows.
+
+    See :class:`KeysetOrdering` for ``ordering`` and ``extra``.
+
+    """
+
+    def count(self):
+        return self.queryset.count() + len(self.extra)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+
+        extra = self.sort(self.extra)
+
+        # At most every extra object comes before the slice
+        offset = max(start - len(extra), 0)
+
+        rows = list(self.get_queryset()[offset:stop])
+
+        positions = []
+
+        for row_index, row in enumerate(rows):
+            before = len([obj for obj in extra if self.compare(obj, row) < 0])
+
+            positions.append((offset + row_index + before, row))
+
+        for rank, obj in enumerate(extra):
+            if offset and (not rows or self.compare(obj, rows[0]) < 0):
+                # Located among rows which have not been fetched,
+                # so before the slice
+                continue
+
+            before = len([row for row in rows if self.compare(row, obj) < 0])
+
+            positions.append((offset + before + rank, obj))
+
+        return [
+            obj
+            for position, obj in sorted(positions, key=lambda position: position[0])
+            if start <= position < stop
+        ]
+
+
+class CursorPage(object):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return "<Page of %d objects>" % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode(self.object_list[-1])
+
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.encode(self.object_list[0], reverse=True)
+
+        return None
@@ -0,0 +1,42 @@
+from .. import settings
+from ..utils import load_class
+
+
+def get_backend():
+    """
+    Returns an instance of the configured search backend,
+    ``None`` when search is disabled.
+
+    """
+    if not settings.SEARCH_BACKEND:
+        return None
+
+    return load_class(settings.SEARCH_BACKEND)()
+
+
+def index_message(message):
+    backend = get_backend()
+
+    if backend is not None:
+        backend.index_messages([message])
+
+
+def delete_message(message):
+    backend = get_backend()
+
+    if backend is not None:
+        backend.delete([message.pk])
+
+
+def search_discussions(user, query):
+    """
+    Returns ids of discussions of ``user`` matching ``query``,
+    the most relevant first.
+
+    """
+    backend = get_backend()
+
+    if backend is None:
+        return []
+
+    return backend.search(user, query, settings.SEARCH_MAX_RESULTS)
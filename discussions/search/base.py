@@ -0,0 +1,128 @@
+from django.db import connections, router, transaction
+
+
+class BaseSearchBackend(object):
+    """
+    Stores tokenized subjects and bodies of messages and searches them
+    among the discussions a user is a recipient of.
+
+    Documents are stored in ``table_name``, one per message.
+
+    """
+
+    table_name = "discussions_search"
+
+    # Whether chunks of the index can be rebuilt concurrently
+    supports_parallel_indexing = True
+
+    def __init__(self, using=None, table_name=None):
+        from ..models import Message
+
+        self.using = using or router.db_for_write(Message)
+
+        if table_name is not None:
+            self.table_name = table_name
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def get_recipient_table(self):
+        from ..models import Recipient
+
+        return self.connection.ops.quote_name(Recipient._meta.db_table)
+
+    def get_deleted_status(self):
+        from ..models import Recipient
+
+        return Recipient.STATUS.deleted
+
+    def setup(self):
+        """ Creates the storage of the index when it does not exist """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Removes every document from the index """
+        raise NotImplementedError
+
+    def drop(self):
+        """ Removes the storage of the index when it exists """
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % self.table_name)
+
+    def rename(self, table_name):
+        """ Moves the storage of the index to ``table_name`` """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "ALTER TABLE %s RENAME TO %s" % (self.table_name, table_name)
+            )
+
+        self.table_name = table_name
+
+    def replace(self, other):
+        """
+        Replaces the index by ``other``, built aside, in a single
+        transaction: searches never see a partial index.
+
+        """
+        with transaction.atomic(using=self.using):
+            self.drop()
+            other.rename(self.table_name)
+
+    def index(self, rows):
+        """
+        Adds or replaces documents.
+
+        :param rows:
+            A list of ``(message_id, discussion_id, subject, body)``.
+
+        """
+        raise NotImplementedError
+
+    def delete(self, message_ids):
+        """ Removes documents of ``message_ids`` from the index """
+        raise NotImplementedError
+
+    def search(self, user, query, limit):
+        """
+        Returns ids of the discussions of ``user`` matching ``query``,
+        the most relevant first, discussions they deleted excluded.
+
+        """
+        raise NotImplementedError
+
+    def index_messages(self, messages):
+        self.index(
+            [
+                (message.pk, message.discussion_id, message.discussion.subject, message.body)
+                for message in messages
+            ]
+        )
+
+    def index_range(self, start, end=None):
+        """
+        Indexes messages which ids are between ``start`` (included)
+        and ``end`` (excluded), every following message when ``end``
+        is ``None``.
+
+        :return:
+            The number of indexed messages.
+
+        """
+        from ..models import Message
+
+        messages = Message.objects.using(self.using).filter(pk__gte=start)
+
+        if end is not None:
+            messages = messages.filter(pk__lt=end)
+
+        rows = list(
+            messages.order_by().values_list(
+                "pk", "discussion_id", "discussion__subject", "body"
+            )
+        )
+
+        if rows:
+            self.index(rows)
+
+        return len(rows)
@@ -0,0 +1,93 @@
+from .base import BaseSearchBackend
+from .. import settings
+
+
+class PostgreSQLSearchBackend(BaseSearchBackend):
+    """
+    Stores documents as ``tsvector`` in a table indexed with GIN,
+    subjects are weighted above bodies in the ranking.
+
+    """
+
+    def setup(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS %(table)s ("
+                "message_id integer PRIMARY KEY, "
+                "discussion_id integer NOT NULL, "
+                "document tsvector NOT NULL)" % {"table": self.table_name}
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS %(table)s_document "
+                "ON %(table)s USING GIN (document)" % {"table": self.table_name}
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS %(table)s_discussion "
+                "ON %(table)s (discussion_id)" % {"table": self.table_name}
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("TRUNCATE %s" % self.table_name)
+
+    def rename(self, table_name):
+        # Indexes are named after the table
+        with self.connection.cursor() as cursor:
+            for suffix in ("pkey", "document", "discussion"):
+                cursor.execute(
+                    "ALTER INDEX IF EXISTS %s_%s RENAME TO %s_%s"
+                    % (self.table_name, suffix, table_name, suffix)
+                )
+
+        super(PostgreSQLSearchBackend, self).rename(table_name)
+
+    def index(self, rows):
+        config = settings.SEARCH_CONFIG
+
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO %s (message_id, discussion_id, document) "
+                "VALUES (%%s, %%s, "
+                "setweight(to_tsvector(%%s, %%s), 'A') || "
+                "setweight(to_tsvector(%%s, %%s), 'B')) "
+                "ON CONFLICT (message_id) DO UPDATE "
+                "SET discussion_id = EXCLUDED.discussion_id, "
+                "document = EXCLUDED.document" % self.table_name,
+                [
+                    (message_id, discussion_id, config, subject, config, body)
+                    for message_id, discussion_id, subject, body in rows
+                ],
+            )
+
+    def delete(self, message_ids):
+        if not message_ids:
+            return
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE message_id = ANY(%%s)" % self.table_name,
+                [list(message_ids)],
+            )
+
+    def search(self, user, query, limit):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s.discussion_id, MAX(ts_rank(s.document, q)) AS score "
+                "FROM %(table)s s "
+                "INNER JOIN %(recipient)s r ON r.discussion_id = s.discussion_id, "
+                "plainto_tsquery(%%s, %%s) q "
+                "WHERE s.document @@ q AND r.user_id = %%s AND r.status <> %%s "
+                "GROUP BY s.discussion_id "
+                "ORDER BY score DESC, s.discussion_id DESC "
+                "LIMIT %%s"
+                % {"table": self.table_name, "recipient": self.get_recipient_table()},
+                [
+                    settings.SEARCH_CONFIG,
+                    query,
+                    user.pk,
+                    self.get_deleted_status(),
+                    limit,
+                ],
+            )
+
+            return [row[0] for row in cursor.fetchall()]
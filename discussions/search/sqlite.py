@@ -0,0 +1,75 @@
+import re
+
+from .base import BaseSearchBackend
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Stores documents in a FTS5 virtual table, which rowid is the id of
+    the message. Subjects weigh twice as much as bodies in the ranking.
+
+    """
+
+    # SQLite does not allow concurrent writers
+    supports_parallel_indexing = False
+
+    def setup(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5"
+                "(discussion_id UNINDEXED, subject, body)" % self.table_name
+            )
+            cursor.execute(
+                "INSERT INTO %s (%s, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)')"
+                % (self.table_name, self.table_name)
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s" % self.table_name)
+
+    def index(self, rows):
+        self.delete([row[0] for row in rows])
+
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO %s (rowid, discussion_id, subject, body) "
+                "VALUES (%%s, %%s, %%s, %%s)" % self.table_name,
+                rows,
+            )
+
+    def delete(self, message_ids):
+        if not message_ids:
+            return
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE rowid IN (%s)"
+                % (self.table_name, ", ".join(["%s"] * len(message_ids))),
+                list(message_ids),
+            )
+
+    def get_match_expression(self, query):
+        # Terms are quoted so that the FTS5 query syntax is not interpreted
+        return " ".join('"%s"' % term for term in re.findall(r"\w+", query, re.U))
+
+    def search(self, user, query, limit):
+        expression = self.get_match_expression(query)
+
+        if not expression:
+            return []
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s.discussion_id, MIN(s.rank) AS score "
+                "FROM %(table)s s "
+                "INNER JOIN %(recipient)s r ON r.discussion_id = s.discussion_id "
+                "WHERE %(table)s MATCH %%s AND r.user_id = %%s AND r.status <> %%s "
+                "GROUP BY s.discussion_id "
+                "ORDER BY score, s.discussion_id DESC "
+                "LIMIT %%s"
+                % {"table": self.table_name, "recipient": self.get_recipient_table()},
+                [expression, user.pk, self.get_deleted_status(), limit],
+            )
+
+            return [row[0] for row in cursor.fetchall()]
@@ -3,6 +3,74 @@ from django.conf import settings
 
 PAGINATE_BY = getattr(settings, "DISCUSSIONS_PAGINATE_BY", 20)
 
+CURSOR_PAGINATION = getattr(settings, "DISCUSSIONS_CURSOR_PAGINATION", False)
+
+MESSAGES_PAGINATE_BY = getattr(settings, "DISCUSSIONS_MESSAGES_PAGINATE_BY", 50)
+
+# Number of characters of the latest message shown in the inbox, 255 at most
+EXCERPT_LENGTH = getattr(settings, "DISCUSSIONS_EXCERPT_LENGTH", 140)
+
+# Number of participants stored on discussions to render them in the inbox
+PARTICIPANTS_SNAPSHOT_SIZE = getattr(settings, "DISCUSSIONS_PARTICIPANTS_SNAPSHOT_SIZE", 5)
+
+# Whether composing to a single user appends to the existing direct
+# discussion with them instead of starting a new one
+REUSE_DIRECT_DISCUSSIONS = getattr(
+    settings, "DISCUSSIONS_REUSE_DIRECT_DISCUSSIONS", False
+)
+
+# Whether broadcast discussions are merged into inboxes, they are only
+# visible to their sender otherwise
+BROADCASTS = getattr(settings, "DISCUSSIONS_BROADCASTS", False)
+
+# Named audiences of broadcasts, mapped to the dotted path of a callable
+# returning a queryset of users
+BROADCAST_AUDIENCES = getattr(settings, "DISCUSSIONS_BROADCAST_AUDIENCES", {})
+
+# Broadcasts without activity for this number of days are not merged into
+# inboxes anymore, nor are more than the limit of most recent ones
+BROADCASTS_PENDING_WINDOW = getattr(settings, "DISCUSSIONS_BROADCASTS_PENDING_WINDOW", 30)
+
+BROADCASTS_PENDING_LIMIT = getattr(settings, "DISCUSSIONS_BROADCASTS_PENDING_LIMIT", 20)
+
+# Audiences a user belongs to are cached for this number of seconds,
+# registered audiences each cost a query: users joining an audience
+# receive its broadcasts once the cached value expires
+BROADCAST_AUDIENCES_CACHE_TIMEOUT = getattr(
+    settings, "DISCUSSIONS_BROADCAST_AUDIENCES_CACHE_TIMEOUT", 300
+)
+
+INCREMENTAL_COUNTERS = getattr(settings, "DISCUSSIONS_INCREMENTAL_COUNTERS", False)
+
+CACHE_ALIAS = getattr(settings, "DISCUSSIONS_CACHE_ALIAS", "default")
+
+CACHE_PREFIX = getattr(settings, "DISCUSSIONS_CACHE_PREFIX", "discussions")
+
+# Track reads with a per discussion message sequence instead of rewriting
+# the status of every recipient on each reply
+SEQUENCE_READ_TRACKING = getattr(settings, "DISCUSSIONS_SEQUENCE_READ_TRACKING", False)
+
+# Unread counters are not cached unless a timeout (in seconds) is set
+COUNTERS_CACHE_TIMEOUT = getattr(settings, "DISCUSSIONS_COUNTERS_CACHE_TIMEOUT", None)
+
+# Rendered inbox rows are not cached unless a timeout (in seconds) is set
+ROWS_CACHE_TIMEOUT = getattr(settings, "DISCUSSIONS_ROWS_CACHE_TIMEOUT", None)
+
+# Windows of messages are not cached unless a timeout (in seconds) is set
+MESSAGES_CACHE_TIMEOUT = getattr(settings, "DISCUSSIONS_MESSAGES_CACHE_TIMEOUT", None)
+
+# Whether inbox and detail pages are answered with ETags derived from the
+# cache generations, which requires a cache shared by every node
+CONDITIONAL_GET = getattr(settings, "DISCUSSIONS_CONDITIONAL_GET", False)
+
+# Dotted path of the search backend, messages are not indexed when empty
+SEARCH_BACKEND = getattr(settings, "DISCUSSIONS_SEARCH_BACKEND", None)
+
+# Text search configuration used by the PostgreSQL backend
+SEARCH_CONFIG = getattr(settings, "DISCUSSIONS_SEARCH_CONFIG", "simple")
+
+SEARCH_MAX_RESULTS = getattr(settings, "DISCUSSIONS_SEARCH_MAX_RESULTS", 500)
+
 RECIPIENT_MODEL = getattr(
     settings, "DISCUSSIONS_RECIPIENT_MODEL", "discussions.models.recipient.Recipient"
 )
@@ -15,6 +83,9 @@ FOLDER_MODEL = getattr(
 MESSAGE_MODEL = getattr(
     settings, "DISCUSSIONS_MESSAGE_MODEL", "discussions.models.message.Message"
 )
+INBOX_STATS_MODEL = getattr(
+    settings, "DISCUSSIONS_INBOX_STATS_MODEL", "discussions.models.stats.InboxStats"
+)
 
 DISCUSSION_LIST_VIEW = getattr(
     settings,
@@ -46,6 +117,16 @@ DISCUSSION_DETAIL_VIEW = getattr(
     "DISCUSSIONS_DISCUSSION_DETAIL_VIEW",
     "discussions.views.base.DiscussionDetailView",
 )
+DISCUSSION_MESSAGES_VIEW = getattr(
+    settings,
+    "DISCUSSIONS_DISCUSSION_MESSAGES_VIEW",
+    "discussions.views.base.DiscussionMessagesView",
+)
+DISCUSSION_SEARCH_VIEW = getattr(
+    settings,
+    "DISCUSSIONS_DISCUSSION_SEARCH_VIEW",
+    "discussions.views.base.DiscussionSearchView",
+)
 DISCUSSION_REMOVE_VIEW = getattr(
     settings,
     "DISCUSSIONS_DISCUSSION_REMOVE_VIEW",
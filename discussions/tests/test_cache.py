@@ -0,0 +1,225 @@
+from __future__ import unicode_literals
+
+import time
+
+from django.core.cache.backends.dummy import DummyCache
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from .. import cache
+from ..compat import User
+from ..models import Discussion, Folder, Recipient
+
+
+class GetOrComputeTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_disabled(self):
+        compute = Mock(return_value=1)
+
+        self.assertEqual(cache.get_or_compute("key", compute, None), 1)
+        self.assertEqual(cache.get_or_compute("key", compute, None), 1)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_cached(self):
+        compute = Mock(return_value=1)
+
+        self.assertEqual(cache.get_or_compute("key", compute, 60), 1)
+        self.assertEqual(cache.get_or_compute("key", compute, 60), 1)
+        self.assertEqual(compute.call_count, 1)
+
+    def test_expired_single_flight(self):
+        """ Only the lock holder recomputes an expired value """
+        cache.get_cache().set("key", (1, time.time() - 1), 60)
+        cache.get_cache().add("key:lock", 1)
+
+        compute = Mock(return_value=2)
+
+        self.assertEqual(cache.get_or_compute("key", compute, 60), 1)
+        self.assertEqual(compute.call_count, 0)
+
+        cache.get_cache().delete("key:lock")
+
+        self.assertEqual(cache.get_or_compute("key", compute, 60), 2)
+        self.assertEqual(compute.call_count, 1)
+
+    @patch("discussions.cache.LOCK_RETRIES", 2)
+    @patch("discussions.cache.LOCK_WAIT", 0)
+    def test_missing_locked(self):
+        """ Waiters fall back to computing when the lock holder is too slow """
+        cache.get_cache().add("key:lock", 1)
+
+        compute = Mock(return_value=2)
+
+        self.assertEqual(cache.get_or_compute("key", compute, 60), 2)
+        self.assertEqual(compute.call_count, 1)
+
+
+class GenerationTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+        self.thoas = User.objects.get(username="thoas")
+
+    def assertBumped(self, user, func, *args, **kwargs):
+        generation = cache.get_generation(user.pk)
+
+        func(*args, **kwargs)
+
+        self.assertNotEqual(cache.get_generation(user.pk), generation)
+
+    def test_get_generation(self):
+        generation = cache.get_generation(self.thoas.pk)
+
+        self.assertEqual(cache.get_generation(self.thoas.pk), generation)
+
+        cache.bump_generations([self.thoas.pk])
+        self.assertNotEqual(cache.get_generation(self.thoas.pk), generation)
+
+    def test_get_generation_dummy_cache(self):
+        """ Generations are usable when the cache does not keep them """
+        with patch("discussions.cache.get_cache", return_value=DummyCache("dummy", {})):
+            self.assertIsNotNone(cache.get_generation(self.thoas.pk))
+
+            with patch("discussions.settings.BROADCASTS", True):
+                self.assertIsNotNone(cache.get_generation(self.thoas.pk))
+
+    def test_broadcasts_generation(self):
+        generation = cache.get_generation(self.thoas.pk)
+
+        cache.bump_broadcasts_generation()
+        self.assertEqual(cache.get_generation(self.thoas.pk), generation)
+
+        with patch("discussions.settings.BROADCASTS", True):
+            broadcasts_generation = cache.get_generation(self.thoas.pk)
+            self.assertNotEqual(broadcasts_generation, generation)
+
+            cache.bump_broadcasts_generation()
+            self.assertNotEqual(cache.get_generation(self.thoas.pk), broadcasts_generation)
+
+            # A bump is seen whatever the clock of the node which made it
+            broadcasts_generation = cache.get_generation(self.thoas.pk)
+
+            with patch("discussions.cache.time.time", return_value=0):
+                cache.bump_generations([self.thoas.pk])
+
+            self.assertNotEqual(cache.get_generation(self.thoas.pk), broadcasts_generation)
+
+    def test_discussion_generations(self):
+        generations = cache.get_discussion_generations([1, 2])
+
+        self.assertEqual(cache.get_discussion_generations([1, 2]), generations)
+
+        # Recipients whose status does not change are not bumped
+        ampelmann = User.objects.get(username="ampelmann")
+        generation = cache.get_generation(self.thoas.pk)
+
+        Discussion.objects.get(pk=1).add_message("Reply", ampelmann)
+
+        self.assertEqual(cache.get_generation(self.thoas.pk), generation)
+        self.assertNotEqual(cache.get_discussion_generations([1])[1], generations[1])
+        self.assertEqual(cache.get_discussion_generations([2])[2], generations[2])
+
+    def test_membership_changes(self):
+        """ Every participant sees membership changes """
+        oleiade = User.objects.get(username="oleiade")
+        discussion = Discussion.objects.get(pk=1)
+
+        for func, args in (
+            (discussion.save_recipients, [[oleiade]]),
+            (discussion.delete_recipient, [oleiade]),
+        ):
+            generation = cache.get_discussion_generations([1])[1]
+            version = Discussion.objects.get(pk=1).get_version()
+
+            func(*args)
+
+            self.assertNotEqual(cache.get_discussion_generations([1])[1], generation)
+            self.assertNotEqual(Discussion.objects.get(pk=1).get_version(), version)
+
+    def test_write_paths(self):
+        ampelmann = User.objects.get(username="ampelmann")
+        recipient = Recipient.objects.get(pk=3)
+
+        self.assertBumped(self.thoas, recipient.mark_as_read)
+        self.assertBumped(self.thoas, recipient.mark_as_read)
+        self.assertBumped(
+            self.thoas, Discussion.objects.get(pk=2).add_message, "Reply", ampelmann
+        )
+        self.assertBumped(
+            self.thoas, Discussion.objects.send_message, ampelmann, [self.thoas], "Hi", "Hi"
+        )
+        folder = Folder(user=self.thoas, name="Folder")
+
+        self.assertBumped(self.thoas, folder.save)
+        self.assertBumped(self.thoas, folder.delete)
+
+
+@patch("discussions.settings.COUNTERS_CACHE_TIMEOUT", 60)
+class UnreadCountersCacheTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+
+    def tearDown(self):
+        cache.get_cache().clear()
+
+    def test_count_unread_messages_for(self):
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 1)
+
+        with self.assertNumQueries(0):
+            Recipient.objects.count_unread_messages_for(self.thoas)
+
+        Recipient.objects.get(pk=3).mark_as_read()
+
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 0)
+
+    def test_count_unread_messages_between(self):
+        self.assertEqual(
+            Recipient.objects.count_unread_messages_between(
+                self.ampelmann, self.thoas
+            ),
+            1,
+        )
+
+        with self.assertNumQueries(0):
+            Recipient.objects.count_unread_messages_between(self.ampelmann, self.thoas)
+
+        Discussion.objects.get(pk=1).mark_as_read(self.ampelmann)
+
+        self.assertEqual(
+            Recipient.objects.count_unread_messages_between(
+                self.ampelmann, self.thoas
+            ),
+            0,
+        )
+
+    def test_add_message(self):
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 1)
+
+        Discussion.objects.get(pk=2).add_message("Reply", self.ampelmann)
+
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 2)
+
+    @patch("discussions.settings.SEQUENCE_READ_TRACKING", True)
+    def test_add_message_sequence_read_tracking(self):
+        recipient = Recipient.objects.get(pk=3)
+        recipient.mark_as_read()
+
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 0)
+
+        # Only the discussion is bumped, counters read its generation
+        generation = cache.get_generation(self.thoas.pk)
+
+        recipient.discussion.add_message("Reply", self.ampelmann)
+
+        self.assertEqual(cache.get_generation(self.thoas.pk), generation)
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.thoas), 1)
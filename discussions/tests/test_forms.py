@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 
 from django.test import TestCase
 
+from mock import patch
+
 from ..forms import ComposeForm, ReplyForm, FolderForm
 from ..models import Discussion
 from ..compat import User
@@ -64,6 +66,21 @@ class ComposeFormTests(TestCase):
         self.assertEqual(discussion.recipients.all()[0].username, "ampelmann")
         self.assertEqual(discussion.recipients.all()[1].username, "thoas")
 
+    @patch.object(ComposeForm, "reuse_direct_discussion", True)
+    def test_save_direct_discussion(self):
+        sender = User.objects.get(username="oleiade")
+        data = {"to": "thoas", "body": "Body", "subject": "subject"}
+
+        form = ComposeForm(data=data)
+        self.assertTrue(form.is_valid())
+        discussion = form.save(sender)
+
+        form = ComposeForm(data=dict(data, body="Again"))
+        self.assertTrue(form.is_valid())
+
+        self.assertEqual(form.save(sender), discussion)
+        self.assertEqual(discussion.messages.count(), 2)
+
 
 class ReplyFormTests(TestCase):
     fixtures = ["users.json", "messages.json"]
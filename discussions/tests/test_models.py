@@ -1,9 +1,22 @@
 from __future__ import unicode_literals
 
+import datetime
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import signals
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now as tznow
+
+from mock import Mock, patch
+from six import StringIO
 
-from ..models import Message, Recipient
-from ..compat import truncate_words
+from .. import cache
+from ..managers import DiscussionManager
+from ..models import Discussion, Folder, InboxStats, Message, Recipient
+from ..compat import truncate_words, User
 
 
 class MessageModelTests(TestCase):
@@ -41,3 +54,852 @@ class MessageRecipientModelTest(TestCase):
 
         self.assertFalse(new_message.is_read())
         self.assertTrue(read_message.is_read())
+
+
+class DiscussionManagerTests(TestCase):
+    fixtures = ["users.json"]
+
+    def _send_message(self, to_user_list):
+        sender = User.objects.get(username="thoas")
+
+        with CaptureQueriesContext(connection) as context:
+            discussion = Discussion.objects.send_message(
+                sender, to_user_list, "Subject", "Body"
+            )
+
+        return discussion, len(context.captured_queries)
+
+    def test_send_message_queries(self):
+        """ Sending a message costs the same whatever the number of recipients """
+        users = [
+            User.objects.create_user(username="user%d" % i, password="$ecret")
+            for i in range(10)
+        ]
+
+        # Direct discussions look their canonical discussion up first
+        discussion, single_count = self._send_message(users[:2])
+
+        self.assertEqual(discussion.recipients_count, 3)
+        self.assertEqual(discussion.messages_count, 1)
+
+        discussion, multiple_count = self._send_message(users)
+
+        self.assertEqual(single_count, multiple_count)
+        self.assertEqual(discussion.recipients_count, 11)
+        self.assertEqual(discussion.recipients.count(), 11)
+        self.assertEqual(discussion.messages_count, 1)
+
+    def test_send_message_denormalization(self):
+        """ Recipients carry the sort key and sender role of the discussion """
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion, count = self._send_message([ampelmann])
+
+        recipients = dict(
+            (r.user_id, r) for r in Recipient.objects.filter(discussion=discussion)
+        )
+
+        self.assertTrue(recipients[thoas.pk].is_sender)
+        self.assertFalse(recipients[ampelmann.pk].is_sender)
+
+        for recipient in recipients.values():
+            self.assertEqual(recipient.last_activity_at, discussion.updated_at)
+
+        discussion.add_message("Reply", ampelmann)
+
+        self.assertEqual(
+            set(discussion.recipient_set.values_list("last_activity_at", flat=True)),
+            set([discussion.updated_at]),
+        )
+
+    @patch("discussions.settings.EXCERPT_LENGTH", 10)
+    def test_latest_message_snapshot(self):
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion, count = self._send_message([ampelmann])
+        discussion.add_message("A rather long reply", ampelmann)
+
+        discussion = Discussion.objects.get(pk=discussion.pk)
+
+        self.assertTrue(discussion.latest_message_excerpt.startswith("A rather"))
+        self.assertTrue(len(discussion.latest_message_excerpt) <= 10)
+        self.assertEqual(discussion.latest_message_sender, ampelmann)
+
+    def test_send_message_to_sender(self):
+        """ The sender is saved once even when listed in the recipients """
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion, count = self._send_message([thoas, ampelmann])
+
+        self.assertEqual(discussion.recipients.count(), 2)
+        self.assertEqual(discussion.recipients_count, 2)
+
+
+class DirectDiscussionTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+        self.oleiade = User.objects.get(username="oleiade")
+
+    def test_send_message(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Hi"
+        )
+
+        self.assertEqual(
+            discussion.pair_key, "%s:%s" % (self.thoas.pk, self.ampelmann.pk)
+        )
+        self.assertEqual(
+            Discussion.objects.get_direct_discussion(self.ampelmann, self.thoas),
+            discussion,
+        )
+
+        # Group discussions and later direct discussions are not canonical
+        group = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann, self.oleiade], "Hi", "Hi"
+        )
+        self.assertIsNone(group.pair_key)
+
+        other = Discussion.objects.send_message(
+            self.ampelmann, [self.thoas], "Hi", "Hi"
+        )
+        self.assertNotEqual(other, discussion)
+        self.assertIsNone(other.pair_key)
+
+    def test_send_message_reuse(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Hi"
+        )
+
+        with self.assertNumQueries(1):
+            direct = Discussion.objects.get_direct_discussion(self.thoas, self.ampelmann)
+
+        self.assertEqual(direct, discussion)
+
+        reused = Discussion.objects.send_message(
+            self.ampelmann, [self.thoas], "Hello", "Hello", reuse=True
+        )
+
+        self.assertEqual(reused, discussion)
+        self.assertEqual(Discussion.objects.count(), 1)
+
+        discussion = Discussion.objects.get(pk=discussion.pk)
+        self.assertEqual(discussion.messages_count, 2)
+        self.assertEqual(discussion.latest_message.sender, self.ampelmann)
+        self.assertTrue(
+            Recipient.objects.get(discussion=discussion, user=self.thoas).is_unread()
+        )
+
+    def test_send_message_reuse_deleted(self):
+        """ Participants who deleted the discussion get it back """
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Hi"
+        )
+        discussion.recipient_set.update(status=Recipient.STATUS.deleted, deleted_at=tznow())
+        Discussion.objects.filter(pk=discussion.pk).update(sender_deleted_at=tznow())
+
+        Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hello", "Hello", reuse=True
+        )
+
+        recipients = dict(
+            (r.user_id, r) for r in Recipient.objects.filter(discussion=discussion)
+        )
+
+        self.assertTrue(recipients[self.thoas.pk].is_read())
+        self.assertTrue(recipients[self.ampelmann.pk].is_unread())
+        self.assertIsNone(recipients[self.ampelmann.pk].deleted_at)
+        self.assertIsNone(Discussion.objects.get(pk=discussion.pk).sender_deleted_at)
+
+    @patch("discussions.settings.SEQUENCE_READ_TRACKING", True)
+    def test_send_message_reuse_deleted_sequence(self):
+        self.test_send_message_reuse_deleted()
+
+    def test_membership_changes(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Hi"
+        )
+
+        discussion.save_recipients([self.oleiade])
+        self.assertIsNone(Discussion.objects.get(pk=discussion.pk).pair_key)
+        self.assertIsNone(
+            Discussion.objects.get_direct_discussion(self.thoas, self.ampelmann)
+        )
+
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.oleiade], "Hi", "Hi"
+        )
+        discussion.delete_recipient(self.oleiade)
+        self.assertIsNone(Discussion.objects.get(pk=discussion.pk).pair_key)
+
+    def test_get_conversation_between(self):
+        sent = Discussion.objects.send_message(self.thoas, [self.ampelmann], "Hi", "Hi")
+        received = Discussion.objects.send_message(
+            self.ampelmann, [self.thoas], "Hi", "Hi"
+        )
+        Discussion.objects.send_message(self.thoas, [self.oleiade], "Hi", "Hi")
+
+        self.assertEqual(
+            set(Discussion.objects.get_conversation_between(self.thoas, self.ampelmann)),
+            set([sent, received]),
+        )
+
+        Recipient.objects.get(discussion=received, user=self.thoas).mark_as_deleted()
+
+        self.assertEqual(
+            list(Discussion.objects.get_conversation_between(self.thoas, self.ampelmann)),
+            [sent],
+        )
+
+
+class ParticipantsSnapshotTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+        self.oleiade = User.objects.get(username="oleiade")
+
+    def get_participant_names(self, discussion):
+        discussion = Discussion.objects.get(pk=discussion.pk)
+
+        return [participant["name"] for participant in discussion.get_participants()]
+
+    @patch("discussions.settings.PARTICIPANTS_SNAPSHOT_SIZE", 2)
+    def test_send_message(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann, self.oleiade], "Hi", "Hi"
+        )
+
+        self.assertEqual(self.get_participant_names(discussion), ["ampelmann", "oleiade"])
+
+        discussion = Discussion.objects.get(pk=discussion.pk)
+        self.assertEqual(discussion.count_hidden_participants(), 1)
+
+    @patch("discussions.settings.PARTICIPANTS_SNAPSHOT_SIZE", 2)
+    def test_recipients(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Hi"
+        )
+
+        discussion.delete_recipient(self.ampelmann)
+        self.assertEqual(self.get_participant_names(discussion), ["thoas"])
+
+        discussion = Discussion.objects.get(pk=discussion.pk)
+        discussion.save_recipients([self.oleiade, self.ampelmann])
+        self.assertEqual(self.get_participant_names(discussion), ["thoas", "oleiade"])
+
+        Recipient.objects.get(discussion=discussion, user=self.oleiade).delete()
+        self.assertEqual(self.get_participant_names(discussion), ["thoas"])
+
+        discussion.refresh_participants_snapshot()
+        self.assertEqual(self.get_participant_names(discussion), ["thoas", "ampelmann"])
+
+
+class DiscussionAccessTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def test_get_for_user(self):
+        ampelmann = User.objects.get(username="ampelmann")
+
+        with self.assertNumQueries(1):
+            discussion = Discussion.objects.get_for_user(1, ampelmann)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(discussion.can_view(ampelmann))
+            self.assertTrue(discussion.is_recipient(ampelmann))
+            self.assertEqual(discussion.sender.username, "thoas")
+            self.assertEqual(
+                discussion.get_recipient(ampelmann).discussion, discussion
+            )
+
+    def test_get_for_user_not_recipient(self):
+        oleiade = User.objects.get(username="oleiade")
+
+        with self.assertNumQueries(2):
+            discussion = Discussion.objects.get_for_user(1, oleiade)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(discussion.is_recipient(oleiade))
+
+        self.assertRaises(
+            Discussion.DoesNotExist, Discussion.objects.get_for_user, 42, oleiade
+        )
+
+    def test_is_recipient(self):
+        discussion = Discussion.objects.get(pk=1)
+        oleiade = User.objects.get(username="oleiade")
+
+        self.assertFalse(discussion.is_recipient(oleiade))
+
+        discussion.save_recipients([oleiade])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(discussion.is_recipient(oleiade))
+
+        # Membership is checked for the user alone
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn("LIMIT", context.captured_queries[0]["sql"])
+
+
+@patch("discussions.settings.INCREMENTAL_COUNTERS", True)
+class ParticipantsTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def setUp(self):
+        self.discussion = Discussion.objects.get(pk=1)
+        self.users = [
+            User.objects.create_user("user%s" % i, "user%s@example.com" % i, "$ecret")
+            for i in range(10)
+        ]
+
+    def test_unique(self):
+        thoas = User.objects.get(username="thoas")
+
+        with transaction.atomic():
+            self.assertRaises(
+                IntegrityError,
+                Recipient.objects.create,
+                discussion=self.discussion,
+                user=thoas,
+            )
+
+    def test_add_participants(self):
+        thoas = User.objects.get(username="thoas")
+        stats = InboxStats.objects.get_for_user(self.users[0])
+
+        users = self.users + self.users[:3] + [thoas]
+
+        # Lookup of current participants, insert, snapshot, stats
+        # and a single counter adjustment
+        with CaptureQueriesContext(connection) as context:
+            added = Recipient.objects.add_participants(self.discussion, users)
+
+        self.assertEqual(added, self.users)
+        self.assertEqual(
+            len([q for q in context.captured_queries if "INSERT" in q["sql"]]), 1
+        )
+        self.assertEqual(
+            len([q for q in context.captured_queries if "recipients_count" in q["sql"]]),
+            1,
+        )
+
+        self.assertEqual(Recipient.objects.filter(discussion=1).count(), 12)
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 12)
+        self.assertEqual(
+            InboxStats.objects.get_for_user(self.users[0]).unread_count,
+            stats.unread_count + 1,
+        )
+
+        # Adding them again changes nothing
+        self.assertEqual(Recipient.objects.add_participants(self.discussion, users), [])
+        self.assertEqual(Recipient.objects.filter(discussion=1).count(), 12)
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 12)
+
+    def test_insert_missing(self):
+        """ Rows inserted meanwhile are skipped and not returned """
+        thoas = User.objects.get(username="thoas")
+
+        recipients = [
+            Recipient(user=user, discussion=self.discussion)
+            for user in [thoas] + self.users[:2]
+        ]
+
+        # The recipient of thoas exists, as if it was inserted concurrently
+        inserted = Recipient.objects.insert_missing(recipients, checked=True)
+
+        self.assertEqual([r.user for r in inserted], self.users[:2])
+        self.assertEqual(Recipient.objects.filter(discussion=1).count(), 4)
+
+    def test_remove_participants(self):
+        thoas = User.objects.get(username="thoas")
+
+        Recipient.objects.add_participants(self.discussion, self.users)
+
+        count = Recipient.objects.remove_participants(
+            self.discussion, [user.pk for user in self.users[:5]] + [thoas]
+        )
+
+        # The sender stays
+        self.assertEqual(count, 5)
+        self.assertTrue(self.discussion.is_recipient(thoas))
+        self.assertFalse(self.discussion.is_recipient(self.users[0]))
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 7)
+
+
+class DiscussionCountersTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def test_update_counters(self):
+        Discussion.objects.update(recipients_count=0, messages_count=0)
+
+        Discussion.objects.update_counters([1, 2])
+
+        for discussion in Discussion.objects.all():
+            self.assertEqual(discussion.recipients_count, 2)
+            self.assertEqual(discussion.messages_count, 1)
+
+    def test_delete_recipients(self):
+        thoas = User.objects.get(username="thoas")
+
+        receiver = Mock()
+        signals.post_delete.connect(receiver, sender=Recipient)
+        self.addCleanup(signals.post_delete.disconnect, receiver, sender=Recipient)
+
+        # Participants snapshots of every discussion are updated at once
+        with self.assertNumQueries(7):
+            Recipient.objects.delete_recipients(Recipient.objects.filter(user=thoas))
+
+        self.assertFalse(Recipient.objects.filter(user=thoas).exists())
+        self.assertEqual(receiver.call_count, 2)
+
+        for discussion in Discussion.objects.all():
+            self.assertEqual(discussion.recipients_count, 1)
+
+
+@patch("discussions.settings.INCREMENTAL_COUNTERS", True)
+class IncrementalCountersTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def test_add_message(self):
+        discussion = Discussion.objects.get(pk=1)
+        ampelmann = User.objects.get(username="ampelmann")
+
+        with CaptureQueriesContext(connection) as context:
+            message = discussion.add_message("Reply", ampelmann)
+
+        self.assertFalse(
+            [q for q in context.captured_queries if "COUNT(" in q["sql"]]
+        )
+
+        discussion = Discussion.objects.get(pk=1)
+        self.assertEqual(discussion.messages_count, 2)
+
+        message.delete()
+
+        discussion = Discussion.objects.get(pk=1)
+        self.assertEqual(discussion.messages_count, 1)
+
+    def test_recipients(self):
+        discussion = Discussion.objects.get(pk=1)
+        oleiade = User.objects.get(username="oleiade")
+
+        discussion.save_recipients([oleiade])
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 3)
+
+        Recipient.objects.get(discussion=discussion, user=oleiade).delete()
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 2)
+
+    def test_delete_recipients(self):
+        Recipient.objects.delete_recipients(Recipient.objects.filter(pk__in=[1, 3]))
+
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 0)
+        self.assertEqual(Discussion.objects.get(pk=2).recipients_count, 2)
+
+    def test_send_message(self):
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion = Discussion.objects.send_message(thoas, [ampelmann], "Hi", "Hi")
+        discussion = Discussion.objects.get(pk=discussion.pk)
+
+        self.assertEqual(discussion.recipients_count, 2)
+        self.assertEqual(discussion.messages_count, 1)
+
+    def test_update_counters(self):
+        discussion = Discussion.objects.get(pk=1)
+        Discussion.objects.filter(pk=1).update(recipients_count=0, messages_count=0)
+
+        discussion.update_counters()
+
+        discussion = Discussion.objects.get(pk=1)
+        self.assertEqual(discussion.recipients_count, 2)
+        self.assertEqual(discussion.messages_count, 1)
+
+
+class InboxStatsTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def setUp(self):
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+
+    def assertStats(self, user, **counts):
+        stats = InboxStats.objects.get(pk=user.pk)
+
+        for name, value in counts.items():
+            self.assertEqual(getattr(stats, name), value)
+
+        fresh = InboxStats.objects.recompute(user)
+
+        for name in ("unread_count", "read_count", "deleted_count", "total_count"):
+            self.assertEqual(getattr(stats, name), getattr(fresh, name))
+
+    def test_get_for_user(self):
+        stats = InboxStats.objects.get_for_user(self.thoas)
+
+        self.assertEqual(stats.unread_count, 1)
+        self.assertEqual(stats.read_count, 1)
+        self.assertEqual(stats.deleted_count, 0)
+        self.assertEqual(stats.total_count, 2)
+
+        with self.assertNumQueries(1):
+            InboxStats.objects.get_for_user(self.thoas)
+
+    def test_mark_as(self):
+        InboxStats.objects.get_for_user(self.thoas)
+
+        recipient = Recipient.objects.get(pk=3)
+        recipient.mark_as_read()
+        self.assertStats(self.thoas, unread_count=0, read_count=2)
+
+        recipient.mark_as_deleted()
+        self.assertStats(self.thoas, read_count=1, deleted_count=1)
+
+        recipient.mark_as_unread()
+        self.assertStats(self.thoas, unread_count=1, deleted_count=0)
+
+    def test_mark_as_concurrent(self):
+        """ Marking a loaded recipient keeps columns changed meanwhile """
+        recipient = Recipient.objects.get(pk=3)
+        folder = Folder.objects.create(user=self.thoas, name="Folder")
+
+        Recipient.objects.filter(pk=3).update(folder=folder)
+
+        recipient.mark_as_read()
+
+        recipient = Recipient.objects.get(pk=3)
+        self.assertTrue(recipient.is_read())
+        self.assertEqual(recipient.folder_id, folder.pk)
+
+    def test_add_message(self):
+        InboxStats.objects.get_for_user(self.thoas)
+        InboxStats.objects.get_for_user(self.ampelmann)
+
+        Discussion.objects.get(pk=2).add_message("Reply", self.ampelmann)
+
+        self.assertStats(self.thoas, unread_count=2, read_count=0)
+        self.assertStats(self.ampelmann, unread_count=1, read_count=1)
+
+    def test_recipients(self):
+        oleiade = User.objects.get(username="oleiade")
+        InboxStats.objects.get_for_user(oleiade)
+
+        Discussion.objects.send_message(self.thoas, [oleiade], "Hi", "Hi")
+        self.assertStats(oleiade, unread_count=1, total_count=1)
+
+        Recipient.objects.filter(user=oleiade).delete()
+        self.assertStats(oleiade, unread_count=0, total_count=0)
+
+
+class SequenceReadTrackingTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        patcher = patch("discussions.settings.SEQUENCE_READ_TRACKING", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+        self.oleiade = User.objects.get(username="oleiade")
+
+        self.discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann, self.oleiade], "Hi", "Hi"
+        )
+
+        self.discussion.mark_as_read()
+
+    def get_recipient(self, user):
+        return Recipient.objects.select_related("discussion").get(
+            discussion=self.discussion, user=user
+        )
+
+    def test_add_message(self):
+        with CaptureQueriesContext(connection) as context:
+            self.discussion.add_message("Reply", self.ampelmann)
+
+        # Only the read mark of the sender is written, whatever the number
+        # of recipients
+        updates = [
+            q["sql"]
+            for q in context.captured_queries
+            if q["sql"].startswith('UPDATE "discussions_recipient"')
+        ]
+
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "last_read_seq"', updates[0])
+        self.assertIn('"user_id" = %s' % self.ampelmann.pk, updates[0])
+
+        self.assertEqual(Discussion.objects.get(pk=self.discussion.pk).last_seq, 2)
+
+        recipient = self.get_recipient(self.thoas)
+        self.assertTrue(recipient.is_unread())
+        self.assertFalse(recipient.is_read())
+        self.assertEqual(recipient.count_new_messages(), 1)
+
+        recipient = self.get_recipient(self.ampelmann)
+        self.assertTrue(recipient.is_read())
+        self.assertEqual(recipient.count_new_messages(), 0)
+
+        self.discussion.add_message("Again", self.ampelmann)
+        self.assertEqual(self.get_recipient(self.oleiade).count_new_messages(), 2)
+
+    def test_count_unread(self):
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.oleiade), 0)
+
+        self.discussion.add_message("Reply", self.ampelmann)
+
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.oleiade), 1)
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.ampelmann), 0)
+        self.assertEqual(
+            Recipient.objects.count_unread_messages_between(self.oleiade, self.thoas),
+            1,
+        )
+
+    def test_mark_as_read(self):
+        self.discussion.add_message("Reply", self.ampelmann)
+
+        self.discussion.mark_as_read(self.oleiade)
+
+        recipient = self.get_recipient(self.oleiade)
+        self.assertTrue(recipient.is_read())
+        self.assertEqual(recipient.last_read_seq, 2)
+
+        self.discussion.add_message("Again", self.ampelmann)
+
+        recipient = self.get_recipient(self.thoas)
+        recipient.mark_as_read()
+
+        recipient = self.get_recipient(self.thoas)
+        self.assertTrue(recipient.is_read())
+        self.assertEqual(recipient.last_read_seq, 3)
+
+    def test_status_filter(self):
+        self.discussion.add_message("Reply", self.ampelmann)
+
+        unread = Recipient.objects.filter(
+            Recipient.objects.get_status_filter(Recipient.STATUS.unread)
+        )
+        read = Recipient.objects.filter(
+            Recipient.objects.get_status_filter(Recipient.STATUS.read)
+        )
+
+        self.assertEqual(
+            sorted(unread.values_list("user__username", flat=True)),
+            ["oleiade", "thoas"],
+        )
+        self.assertEqual(list(read.values_list("user__username", flat=True)), ["ampelmann"])
+
+
+class BroadcastTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+        patcher = patch("discussions.settings.BROADCASTS", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+        self.oleiade = User.objects.get(username="oleiade")
+
+        self.discussion = Discussion.objects.send_broadcast(
+            self.thoas, "News", "Body"
+        )
+
+    def test_send_broadcast(self):
+        # Only the sender is saved
+        self.assertEqual(self.discussion.audience, "all")
+        self.assertEqual(
+            list(self.discussion.recipient_set.values_list("user_id", flat=True)),
+            [self.thoas.pk],
+        )
+        self.assertEqual(self.discussion.messages_count, 1)
+
+        self.assertEqual(
+            list(Discussion.objects.get_pending_broadcasts(self.ampelmann)),
+            [self.discussion],
+        )
+        self.assertFalse(Discussion.objects.get_pending_broadcasts(self.thoas))
+
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.ampelmann), 1)
+        self.assertEqual(
+            Recipient.objects.count_unread_messages_between(self.ampelmann, self.thoas),
+            1,
+        )
+
+        self.assertRaises(
+            ValueError,
+            Discussion.objects.send_broadcast,
+            self.thoas,
+            "News",
+            "Body",
+            "unknown",
+        )
+
+    def test_get_or_create_recipient(self):
+        discussion = Discussion.objects.get(pk=self.discussion.pk)
+
+        self.assertTrue(discussion.can_view(self.ampelmann))
+
+        recipient = discussion.get_or_create_recipient(self.ampelmann)
+
+        self.assertTrue(recipient.is_unread())
+        self.assertEqual(discussion.get_or_create_recipient(self.ampelmann), recipient)
+        self.assertEqual(Discussion.objects.get(pk=discussion.pk).recipients_count, 2)
+        self.assertFalse(Discussion.objects.get_pending_broadcasts(self.ampelmann))
+
+        recipient.mark_as_read()
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.ampelmann), 0)
+
+        # Readers are not shown as participants
+        self.assertEqual(
+            [p["id"] for p in Discussion.objects.get(pk=discussion.pk).get_participants()],
+            [self.thoas.pk],
+        )
+
+    def test_save_pending(self):
+        other = Discussion.objects.send_broadcast(self.thoas, "More news", "Body")
+        InboxStats.objects.get_for_user(self.ampelmann)
+
+        self.assertEqual(Recipient.objects.save_pending(self.ampelmann), 2)
+        self.assertEqual(Recipient.objects.save_pending(self.ampelmann), 0)
+
+        self.assertEqual(InboxStats.objects.get_for_user(self.ampelmann).unread_count, 2)
+        self.assertEqual(Discussion.objects.get(pk=other.pk).recipients_count, 2)
+
+    def test_save_pending_concurrent(self):
+        """ Recipients saved meanwhile are neither duplicated nor counted """
+        pending = Discussion.objects.filter(
+            pk__in=[d.pk for d in Discussion.objects.get_pending_broadcasts(self.ampelmann)]
+        )
+
+        self.discussion.get_or_create_recipient(self.ampelmann)
+        stats = InboxStats.objects.get_for_user(self.ampelmann)
+
+        with patch.object(
+            DiscussionManager, "get_pending_broadcasts", return_value=pending
+        ):
+            self.assertEqual(Recipient.objects.save_pending(self.ampelmann), 0)
+
+        self.assertEqual(Discussion.objects.get(pk=self.discussion.pk).recipients_count, 2)
+        self.assertEqual(
+            InboxStats.objects.get_for_user(self.ampelmann).unread_count,
+            stats.unread_count,
+        )
+
+    @patch("discussions.settings.BROADCASTS_PENDING_LIMIT", 1)
+    def test_pending_limit(self):
+        """ Only the most recent pending broadcasts are merged and counted """
+        other = Discussion.objects.send_broadcast(self.thoas, "More news", "Body")
+
+        self.assertEqual(
+            [r.discussion for r in Recipient.objects.get_pending(self.ampelmann)],
+            [other],
+        )
+        self.assertEqual(Recipient.objects.count_unread_messages_for(self.ampelmann), 1)
+        self.assertEqual(Recipient.objects.save_pending(self.ampelmann), 1)
+
+    def test_pending_window(self):
+        Discussion.objects.filter(pk=self.discussion.pk).update(
+            updated_at=tznow() - datetime.timedelta(days=31)
+        )
+
+        self.assertFalse(Discussion.objects.get_pending_broadcasts(self.ampelmann))
+
+    def test_audience_keys_cached(self):
+        Discussion.objects.get_pending_broadcasts(self.oleiade).count()
+
+        with self.assertNumQueries(1):
+            Discussion.objects.get_pending_broadcasts(self.oleiade).count()
+
+    def test_audience(self):
+        group = Group.objects.create(name="staff")
+        self.oleiade.groups.add(group)
+
+        discussion = Discussion.objects.send_broadcast(
+            self.thoas, "Staff news", "Body", group
+        )
+
+        self.assertTrue(discussion.is_in_audience(self.oleiade))
+        self.assertFalse(discussion.is_in_audience(self.ampelmann))
+
+        self.assertEqual(
+            len(Discussion.objects.get_pending_broadcasts(self.oleiade)), 2
+        )
+        self.assertEqual(
+            len(Discussion.objects.get_pending_broadcasts(self.ampelmann)), 1
+        )
+
+        # Users joining later do not receive previous broadcasts
+        user = User.objects.create_user("newcomer", "newcomer@example.com", "$ecret")
+        self.assertFalse(Discussion.objects.get_pending_broadcasts(user))
+        self.assertFalse(self.discussion.can_view(user))
+
+    def test_disabled(self):
+        with patch("discussions.settings.BROADCASTS", False):
+            with self.assertNumQueries(0):
+                self.assertFalse(Discussion.objects.get_pending_broadcasts(self.ampelmann))
+
+            self.assertFalse(self.discussion.can_view(self.ampelmann))
+
+
+class BackfillTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def backfill(self):
+        stdout = StringIO()
+        call_command("backfill_discussions", chunk_size=1, stdout=stdout)
+
+        self.assertIn("Backfilled 2 discussions", stdout.getvalue())
+
+    def test_sort_keys(self):
+        Recipient.objects.update(is_sender=False, last_activity_at=tznow())
+        Discussion.objects.filter(pk=1).update(updated_at=tznow())
+
+        self.backfill()
+
+        for recipient in Recipient.objects.select_related("discussion"):
+            discussion = recipient.discussion
+
+            self.assertEqual(
+                recipient.is_sender, recipient.user_id == discussion.sender_id
+            )
+            self.assertEqual(
+                recipient.last_activity_at,
+                discussion.updated_at or discussion.created_at,
+            )
+
+    @patch("discussions.settings.EXCERPT_LENGTH", 10)
+    def test_latest_messages(self):
+        Discussion.objects.update(
+            latest_message=None, latest_message_excerpt="", latest_message_sender=None
+        )
+
+        self.backfill()
+
+        for discussion in Discussion.objects.all():
+            message = discussion.messages.order_by("-sent_at", "-pk")[0]
+
+            self.assertEqual(discussion.latest_message, message)
+            self.assertEqual(discussion.latest_message_sender_id, message.sender_id)
+            self.assertTrue(message.body.startswith(discussion.latest_message_excerpt[:-1]))
+            self.assertTrue(len(discussion.latest_message_excerpt) <= 10)
+
+    def test_participants(self):
+        Discussion.objects.update(participants_snapshot="")
+
+        self.backfill()
+
+        for discussion in Discussion.objects.all():
+            self.assertEqual(
+                [participant["id"] for participant in discussion.get_participants()],
+                list(discussion.recipient_set.order_by("pk").values_list("user_id", flat=True)),
+            )
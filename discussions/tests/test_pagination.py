@@ -0,0 +1,155 @@
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import json
+
+from django.test import TestCase
+
+from ..compat import User
+from ..models import Discussion
+from ..pagination import CursorPaginator, InvalidCursor, MergedList
+
+
+class CursorPaginatorTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        for i in range(7):
+            Discussion.objects.send_message(thoas, [ampelmann], "%d" % i, "Body")
+
+        # Same created_at for everyone, pk breaks ties
+        Discussion.objects.update(created_at=Discussion.objects.first().created_at)
+
+        self.paginator = CursorPaginator(
+            Discussion.objects.all(), 3, ("-created_at", "-pk")
+        )
+
+    def test_forward(self):
+        page = self.paginator.page()
+
+        self.assertEqual([d.subject for d in page], ["6", "5", "4"])
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+        page = self.paginator.page(page.next_cursor)
+        self.assertEqual([d.subject for d in page], ["3", "2", "1"])
+        self.assertTrue(page.has_previous())
+
+        page = self.paginator.page(page.next_cursor)
+        self.assertEqual([d.subject for d in page], ["0"])
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+
+    def test_backward(self):
+        page = self.paginator.page(self.paginator.page().next_cursor)
+        page = self.paginator.page(page.next_cursor)
+
+        page = self.paginator.page(page.previous_cursor)
+        self.assertEqual([d.subject for d in page], ["3", "2", "1"])
+        self.assertTrue(page.has_next())
+        self.assertTrue(page.has_previous())
+
+        page = self.paginator.page(page.previous_cursor)
+        self.assertEqual([d.subject for d in page], ["6", "5", "4"])
+        self.assertFalse(page.has_previous())
+
+    def test_constant_queries(self):
+        cursor = self.paginator.page(self.paginator.page().next_cursor).next_cursor
+
+        with self.assertNumQueries(1):
+            self.paginator.page(cursor)
+
+    def test_invalid_cursor(self):
+        # Values must be scalars
+        nested = base64.urlsafe_b64encode(
+            json.dumps([[{}] * len(self.paginator.ordering), False]).encode("utf-8")
+        ).decode("ascii")
+
+        for cursor in ("invalid", "W10=", "W1sxXSwgZmFsc2Vd", nested):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.page(cursor)
+
+
+class MergedListTests(TestCase):
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        start = Discussion.objects.send_message(
+            thoas, [ampelmann], "0", "Body"
+        ).created_at
+
+        for i in range(1, 7):
+            Discussion.objects.send_message(thoas, [ampelmann], "%d" % i, "Body")
+
+        for discussion in Discussion.objects.all():
+            Discussion.objects.filter(pk=discussion.pk).update(
+                created_at=start + datetime.timedelta(minutes=int(discussion.subject))
+            )
+
+        # Before, among and after the saved ones, one of them on a tie
+        self.extra = []
+
+        for i, minutes in enumerate((-1, 2, 2.5, 10)):
+            discussion = Discussion(
+                subject="extra %d" % i,
+                created_at=start + datetime.timedelta(minutes=minutes),
+            )
+
+            self.extra.append(((discussion.created_at, -i - 1), discussion))
+
+        self.ordering = ("-created_at", "-pk")
+
+    def get_subjects(self, objects):
+        return [discussion.subject for discussion in objects]
+
+    def test_slices(self):
+        merged = MergedList(Discussion.objects.all(), self.ordering, self.extra)
+
+        expected = [
+            "extra 3",
+            "6",
+            "5",
+            "4",
+            "3",
+            "extra 2",
+            "2",
+            "extra 1",
+            "1",
+            "0",
+            "extra 0",
+        ]
+
+        self.assertEqual(merged.count(), len(expected))
+
+        for start in range(len(expected) + 1):
+            for stop in range(start, len(expected) + 2):
+                self.assertEqual(
+                    self.get_subjects(merged[start:stop]), expected[start:stop]
+                )
+
+        self.assertEqual(merged[5].subject, "extra 2")
+
+    def test_cursor(self):
+        paginator = CursorPaginator(
+            Discussion.objects.all(), 4, self.ordering, self.extra
+        )
+
+        page = paginator.page()
+        self.assertEqual(self.get_subjects(page), ["extra 3", "6", "5", "4"])
+
+        page = paginator.page(page.next_cursor)
+        self.assertEqual(self.get_subjects(page), ["3", "extra 2", "2", "extra 1"])
+
+        page = paginator.page(page.next_cursor)
+        self.assertEqual(self.get_subjects(page), ["1", "0", "extra 0"])
+        self.assertFalse(page.has_next())
+
+        page = paginator.page(page.previous_cursor)
+        self.assertEqual(self.get_subjects(page), ["3", "extra 2", "2", "extra 1"])
@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from six import StringIO
+
+from mock import patch
+
+from ..compat import User
+from ..models import Discussion, Message
+from ..search import get_backend, search_discussions
+from ..search.base import BaseSearchBackend
+from ..views.base import DiscussionSearchView
+
+
+class SearchTestsMixin(object):
+    fixtures = ["users.json", "messages.json"]
+
+    backend = None
+
+    def setUp(self):
+        patcher = patch("discussions.settings.SEARCH_BACKEND", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        get_backend().setup()
+
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+        self.oleiade = User.objects.get(username="oleiade")
+
+    def test_add_message(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Holidays", "Where should we go?"
+        )
+        message = discussion.add_message("What about the mountains?", self.ampelmann)
+
+        self.assertEqual(search_discussions(self.thoas, "mountains"), [discussion.pk])
+        self.assertEqual(search_discussions(self.ampelmann, "HOLIDAYS"), [discussion.pk])
+        self.assertEqual(search_discussions(self.thoas, "mountains sea"), [])
+
+        # Only discussions of the user are searched
+        self.assertEqual(search_discussions(self.oleiade, "mountains"), [])
+
+        message.delete()
+        self.assertEqual(search_discussions(self.thoas, "mountains"), [])
+
+    def test_ranking(self):
+        body = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Hi", "Let's talk about the budget"
+        )
+        subject = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Budget", "Let's talk"
+        )
+
+        self.assertEqual(
+            search_discussions(self.thoas, "budget"), [subject.pk, body.pk]
+        )
+
+    def test_query_syntax(self):
+        Discussion.objects.send_message(self.thoas, [self.ampelmann], "Hi", "Hello")
+
+        self.assertEqual(search_discussions(self.thoas, '"-*:()'), [])
+        self.assertEqual(len(search_discussions(self.thoas, 'hello" OR')), 0)
+
+    def test_deleted(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Holidays", "Where should we go?"
+        )
+
+        discussion.get_recipient(self.ampelmann).mark_as_deleted()
+
+        self.assertEqual(search_discussions(self.ampelmann, "holidays"), [])
+        self.assertEqual(search_discussions(self.thoas, "holidays"), [discussion.pk])
+
+    def test_rebuild_index(self):
+        get_backend().clear()
+
+        message = Message.objects.get(pk=1)
+        term = message.body.split()[0]
+        sender = message.discussion.sender
+
+        self.assertEqual(search_discussions(sender, term), [])
+
+        message.discussion.add_message("Rebuilding", sender)
+
+        index_range = BaseSearchBackend.index_range
+        searches = []
+
+        # The current index is searched until the new one replaces it
+        def index_and_search(backend, *args):
+            searches.append(search_discussions(sender, "rebuilding"))
+
+            return index_range(backend, *args)
+
+        stdout = StringIO()
+
+        with patch.object(BaseSearchBackend, "index_range", index_and_search):
+            call_command(
+                "rebuild_discussions_index", chunk_size=1, workers=1, stdout=stdout
+            )
+
+        self.assertIn("Indexed %d messages" % Message.objects.count(), stdout.getvalue())
+        self.assertEqual(searches, [[message.discussion_id]] * len(searches))
+
+        self.assertIn(message.discussion_id, search_discussions(sender, term))
+
+        # The index can be rebuilt again
+        call_command("rebuild_discussions_index", workers=1, stdout=StringIO())
+        self.assertIn(message.discussion_id, search_discussions(sender, term))
+
+    def test_search_view(self):
+        discussion = Discussion.objects.send_message(
+            self.thoas, [self.ampelmann], "Holidays", "Where should we go?"
+        )
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        response = self.client.get(reverse("discussions_search"), {"q": "holidays"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "discussions/search.html")
+        self.assertEqual(
+            [recipient.discussion for recipient in response.context["recipient_list"]],
+            [discussion],
+        )
+
+        response = self.client.get(reverse("discussions_search"))
+        self.assertEqual(list(response.context["recipient_list"]), [])
+
+    @patch.object(DiscussionSearchView, "paginate_by", 1)
+    def test_search_view_pages(self):
+        for i in range(2):
+            Discussion.objects.send_message(
+                self.thoas, [self.ampelmann], "Holidays", "Where should we go?"
+            )
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        response = self.client.get(reverse("discussions_search"), {"q": "holidays"})
+        self.assertContains(response, "?q=holidays&amp;page=2")
+
+        response = self.client.get(
+            reverse("discussions_search"), {"q": "holidays", "page": 2}
+        )
+        self.assertEqual(len(response.context["recipient_list"]), 1)
+        self.assertContains(response, "?q=holidays&amp;page=1")
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite is required")
+class SQLiteSearchTests(SearchTestsMixin, TestCase):
+    backend = "discussions.search.sqlite.SQLiteSearchBackend"
+
+
+@skipUnless(connection.vendor == "postgresql", "PostgreSQL is required")
+class PostgreSQLSearchTests(SearchTestsMixin, TestCase):
+    backend = "discussions.search.postgresql.PostgreSQLSearchBackend"
@@ -1,9 +1,17 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from mock import patch
+
+from .. import cache
 from ..forms import ComposeForm, FolderForm
 from ..models import Message, Recipient, Discussion, Folder
 from ..compat import User
+from ..views import DiscussionDetailView, DiscussionListView, DiscussionMessagesView
+from ..views.base import ConditionalGetMixin
 
 
 class DiscussionsViewsTests(TestCase):
@@ -116,6 +124,180 @@ class DiscussionsViewsTests(TestCase):
 
         assert mr.read_at is not None
 
+    @patch("discussions.settings.PARTICIPANTS_SNAPSHOT_SIZE", 2)
+    def test_discussion_detail_recipient_list(self):
+        """ Only participants of the snapshot are listed """
+        discussion = Discussion.objects.get(pk=1)
+        discussion.save_recipients([User.objects.get(username="oleiade")])
+
+        self.client.login(username="ampelmann", password="$ecret")
+        response = self.client.get(
+            reverse("discussions_detail", kwargs={"discussion_id": 1})
+        )
+
+        self.assertEqual(
+            sorted(user.pk for user in response.context["recipient_list"]),
+            sorted(p["id"] for p in Discussion.objects.get(pk=1).get_participants()),
+        )
+        self.assertEqual(len(response.context["recipient_list"]), 2)
+
+    def test_discussion_detail_queryset(self):
+        """ Discussions are looked up in the queryset of the view """
+        self.client.login(username="ampelmann", password="$ecret")
+        url = reverse("discussions_detail", kwargs={"discussion_id": 1})
+
+        with patch.object(
+            DiscussionDetailView,
+            "get_queryset",
+            lambda view: Discussion.objects.exclude(pk=1),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_discussion_detail_already_read(self):
+        """ Viewing a discussion which is already read does not write """
+        self.client.login(username="ampelmann", password="$ecret")
+
+        url = reverse("discussions_detail", kwargs={"discussion_id": 1})
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+
+        self.assertTrue(
+            [q for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [q for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+        )
+
+    def test_discussion_detail_queries(self):
+        """ Loading the detail does not depend on the number of participants """
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        users = [
+            User.objects.create_user("user%d" % i, "user%d@example.com" % i, "$ecret")
+            for i in range(10)
+        ]
+
+        small = Discussion.objects.send_message(thoas, [ampelmann], "Hi", "Hi")
+        large = Discussion.objects.send_message(
+            thoas, [ampelmann] + users, "Hi all", "Hi all"
+        )
+
+        small.mark_as_read()
+        large.mark_as_read()
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        # Inbox stats are computed on the first request
+        self.client.get(reverse("discussions_detail", kwargs={"discussion_id": 1}))
+
+        counts = []
+
+        for discussion in (small, large):
+            url = reverse("discussions_detail", kwargs={"discussion_id": discussion.pk})
+
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(context.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    @patch.object(DiscussionDetailView, "messages_paginate_by", 2)
+    @patch.object(DiscussionMessagesView, "messages_paginate_by", 2)
+    def test_discussion_detail_messages_window(self):
+        """ Only the latest messages are loaded, older ones on demand """
+        discussion = Discussion.objects.get(pk=1)
+        ampelmann = User.objects.get(username="ampelmann")
+
+        for i in range(4):
+            discussion.add_message("Reply %d" % i, ampelmann)
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        response = self.client.get(discussion.get_absolute_url())
+
+        self.assertEqual(
+            [m.body for m in response.context["message_list"]], ["Reply 2", "Reply 3"]
+        )
+
+        url = reverse("discussions_messages", kwargs={"discussion_id": 1})
+
+        response = self.client.get(
+            url, {"cursor": response.context["older_messages_cursor"]}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "discussions/_messages.html")
+        self.assertEqual(
+            [m.body for m in response.context["message_list"]],
+            ["Reply 0", "Reply 1"],
+        )
+
+        response = self.client.get(
+            url, {"cursor": response.context["older_messages_cursor"]}
+        )
+        self.assertEqual(
+            [m.body for m in response.context["message_list"]],
+            ["Hello from your friend"],
+        )
+        self.assertIsNone(response.context["older_messages_cursor"])
+
+        response = self.client.get(url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+        self.client.login(username="oleiade", password="$ecret")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    @patch.object(DiscussionDetailView, "messages_cache_timeout", 60)
+    def test_discussion_detail_messages_cache(self):
+        """ Windows of messages are shared by participants """
+        cache.get_cache().clear()
+
+        discussion = Discussion.objects.get(pk=1)
+        thoas = User.objects.get(username="thoas")
+        url = reverse("discussions_detail", kwargs={"discussion_id": 1})
+
+        self.client.login(username="thoas", password="$ecret")
+        self.client.get(url)
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.context["message_list"]), 1)
+        self.assertFalse(
+            [q for q in context.captured_queries if '"discussions_message"' in q["sql"]]
+        )
+
+        discussion.add_message("Fresh reply", thoas)
+
+        response = self.client.get(url)
+        self.assertEqual(
+            [m.body for m in response.context["message_list"]][-1], "Fresh reply"
+        )
+
+        # Invalid cursors are rejected before the cache is looked up
+        with patch("discussions.cache.get_or_compute") as get_or_compute:
+            response = self.client.get(
+                reverse("discussions_messages", kwargs={"discussion_id": 1}),
+                {"cursor": "invalid"},
+            )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(get_or_compute.called)
+
     def test_discussion_detail_new_message(self):
         self.client.login(username="ampelmann", password="$ecret")
         discussion = Discussion.objects.get(pk=1)
@@ -194,6 +376,53 @@ class DiscussionsViewsTests(TestCase):
 
         self.assertTrue(recipient.is_read())
 
+    def test_discussion_mark_as_read_select_all(self):
+        """ ``POST`` to mark every unread discussion of the inbox as read """
+        self.client.login(username="ampelmann", password="$ecret")
+
+        Recipient.objects.filter(pk=4).update(folder=None, status=Recipient.STATUS.unread)
+
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                reverse("discussions_mark_as_read"),
+                data={"select_all": "1", "status": "unread"},
+            )
+
+        self.assertRedirects(response, reverse("discussions_list"))
+
+        # Recipient in a folder is left untouched
+        self.assertTrue(Recipient.objects.get(pk=1).is_unread())
+        self.assertTrue(Recipient.objects.get(pk=4).is_read())
+
+        response = self.client.post(
+            reverse("discussions_mark_as_unread", kwargs={"folder_id": 1}),
+            data={"select_all": "1"},
+        )
+
+        self.assertTrue(Recipient.objects.get(pk=1).is_unread())
+        self.assertTrue(Recipient.objects.get(pk=4).is_read())
+
+        Recipient.objects.filter(pk=4).update(folder=1)
+
+        response = self.client.post(
+            reverse("discussions_mark_as_read", kwargs={"folder_id": 1}),
+            data={"select_all": "1"},
+        )
+        self.assertRedirects(
+            response,
+            reverse("discussions_list", kwargs={"folder_id": 1}),
+            fetch_redirect_response=False,
+        )
+
+        self.assertTrue(Recipient.objects.get(pk=1).is_read())
+
+        response = self.client.post(
+            reverse("discussions_mark_as_unread", kwargs={"folder_id": 1}),
+            data={"select_all": "1", "status": "invalid"},
+        )
+
+        self.assertTrue(Recipient.objects.get(pk=1).is_read())
+
     def test_valid_discussion_mark_as_unread(self):
         """ ``POST`` to mark a discussion as unread"""
         # Test that sign in is required
@@ -239,6 +468,38 @@ class DiscussionsViewsTests(TestCase):
 
         self.assertFalse(Discussion.objects.get(pk=1).recipients.filter(pk=2).exists())
 
+    def test_discussion_leave_multiple(self):
+        """ ``POST`` to leave several discussions at once """
+        thoas = User.objects.get(username="thoas")
+        oleiade = User.objects.get(username="oleiade")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion = Discussion.objects.send_message(
+            oleiade, [ampelmann, thoas], "Hi", "Hi"
+        )
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+        response = self.client.post(
+            reverse("discussions_leave"),
+            data={"discussion_ids": [1, 2, discussion.pk]},
+            follow=True,
+        )
+
+        self.assertEqual(
+            [m.level_tag for m in response.context["messages"]],
+            ["success", "error", "success"],
+        )
+
+        self.assertEqual(
+            list(Recipient.objects.filter(user=ampelmann).values_list("discussion_id", flat=True)),
+            [2],
+        )
+
+        discussion = Discussion.objects.get(pk=discussion.pk)
+        self.assertEqual(discussion.recipients_count, 2)
+        self.assertEqual(Discussion.objects.get(pk=1).recipients_count, 1)
+
     def test_invalid_discussion_leave_when_sender(self):
         """ ``POST`` to leave a discussion
         # Test that sign in is required'"""
@@ -291,6 +552,62 @@ class DiscussionsViewsTests(TestCase):
 
         assert dr.deleted_at is not None
 
+    def test_discussion_remove_queries(self):
+        """ Removing discussions costs the same whatever their number """
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion_ids = [
+            Discussion.objects.send_message(thoas, [ampelmann], "Hi", "Hi").pk
+            for i in range(5)
+        ]
+
+        self.client.login(username="thoas", password="$ecret")
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(
+                reverse("discussions_remove"), data={"discussion_ids": [1]}
+            )
+
+        with CaptureQueriesContext(connection) as other_context:
+            self.client.post(
+                reverse("discussions_remove"), data={"discussion_ids": discussion_ids}
+            )
+
+        self.assertEqual(
+            len(context.captured_queries), len(other_context.captured_queries)
+        )
+        self.assertEqual(
+            Discussion.objects.filter(
+                pk__in=discussion_ids, sender_deleted_at__isnull=False
+            ).count(),
+            5,
+        )
+        self.assertEqual(
+            Recipient.objects.filter(
+                discussion__in=discussion_ids,
+                user=thoas,
+                status=Recipient.STATUS.deleted,
+            ).count(),
+            5,
+        )
+
+        self.client.post(
+            reverse("discussions_unremove"), data={"discussion_ids": discussion_ids}
+        )
+
+        self.assertFalse(
+            Discussion.objects.filter(
+                pk__in=discussion_ids, sender_deleted_at__isnull=False
+            ).exists()
+        )
+        self.assertEqual(
+            Recipient.objects.filter(
+                discussion__in=discussion_ids, user=thoas, status=Recipient.STATUS.read
+            ).count(),
+            5,
+        )
+
     def test_invalid_discussion_remove(self):
         """ ``POST`` to remove an invalid discussion """
         # Sign in
@@ -350,6 +667,188 @@ class DiscussionsViewsTests(TestCase):
 
         self.assertTemplateUsed(response, "discussions/list.html")
 
+    def test_discussion_list_queries(self):
+        """ The number of queries of an inbox page does not depend on its size """
+        self.client.login(username="thoas", password="$ecret")
+        self.client.get(reverse("discussions_list"))
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("discussions_list"))
+
+        thoas = User.objects.get(username="thoas")
+
+        for username in ("ampelmann", "oleiade"):
+            Discussion.objects.send_message(
+                User.objects.get(username=username), [thoas], "Hi", "Hi"
+            )
+
+        Discussion.objects.get(pk=1).add_message("Reply", thoas)
+
+        with CaptureQueriesContext(connection) as other_context:
+            response = self.client.get(reverse("discussions_list"))
+
+        self.assertEqual(len(response.context["recipient_list"]), 4)
+        self.assertContains(response, "Reply")
+        self.assertFalse(
+            [
+                q
+                for q in other_context.captured_queries
+                if '"discussions_message"' in q["sql"]
+            ]
+        )
+        # Participants are rendered from their snapshot
+        self.assertContains(response, "oleiade")
+        self.assertFalse(
+            [
+                q
+                for q in other_context.captured_queries
+                if 'FROM "auth_user" INNER JOIN "discussions_recipient"' in q["sql"]
+            ]
+        )
+        self.assertEqual(
+            len(context.captured_queries), len(other_context.captured_queries)
+        )
+
+    @patch.object(DiscussionListView, "rows_cache_timeout", 60)
+    def test_discussion_list_rows_cache(self):
+        """ Inbox rows are rendered once per version of their discussion """
+        cache.get_cache().clear()
+
+        self.client.login(username="thoas", password="$ecret")
+        response = self.client.get(reverse("discussions_list"))
+        self.assertContains(response, Discussion.objects.get(pk=1).subject)
+
+        # The subject is not part of the version and rows do not depend on
+        # the rest of the inbox, the row is served from cache
+        Discussion.objects.filter(pk=1).update(subject="Renamed")
+        cache.bump_generations([1])
+
+        with patch("discussions.views.base.render_to_string") as render:
+            response = self.client.get(reverse("discussions_list"))
+
+        self.assertFalse(render.called)
+        self.assertNotContains(response, "Renamed")
+
+        Discussion.objects.get(pk=1).add_message("Fresh reply", User.objects.get(pk=2))
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertContains(response, "Renamed")
+        self.assertContains(response, "Fresh reply")
+
+    @patch.object(ConditionalGetMixin, "conditional_get", True)
+    def test_discussion_list_conditional_get(self):
+        self.client.login(username="thoas", password="$ecret")
+
+        etag = self.client.get(reverse("discussions_list"))["ETag"]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("discussions_list"), HTTP_IF_NONE_MATCH=etag
+            )
+
+        # Neither the page is listed nor rendered
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(
+            [q for q in context.captured_queries if "discussions_" in q["sql"]]
+        )
+
+        # Status views have their own validators
+        response = self.client.get(reverse("discussions_unread"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Recipient.objects.get(pk=3).mark_as_read()
+
+        response = self.client.get(reverse("discussions_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # A reply leaves the status of thoas unchanged, the generation of
+        # its discussion moves
+        Recipient.objects.get(pk=3).mark_as_unread()
+        etag = self.client.get(reverse("discussions_list"))["ETag"]
+
+        Discussion.objects.get(pk=1).add_message("Reply", User.objects.get(pk=2))
+
+        response = self.client.get(reverse("discussions_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @patch.object(ConditionalGetMixin, "conditional_get", True)
+    def test_discussion_detail_conditional_get(self):
+        self.client.login(username="ampelmann", password="$ecret")
+        url = reverse("discussions_detail", kwargs={"discussion_id": 1})
+
+        # The discussion does not date changes of its recipients
+        response = self.client.get(url)
+        self.assertFalse(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Discussion.objects.get(pk=1).add_message("Reply", User.objects.get(pk=1))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            Recipient.objects.get(discussion=1, user__username="ampelmann").is_read()
+        )
+
+        # Not modified responses are not served to other users
+        self.client.login(username="thoas", password="$ecret")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_disabled(self):
+        self.client.login(username="thoas", password="$ecret")
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.client.get(
+            reverse("discussions_detail", kwargs={"discussion_id": 1})
+        )
+        self.assertFalse(response.has_header("ETag"))
+
+    @patch.object(ConditionalGetMixin, "conditional_get", True)
+    def test_conditional_get_dummy_cache(self):
+        self.client.login(username="thoas", password="$ecret")
+
+        with patch("discussions.cache.get_cache", return_value=DummyCache("dummy", {})):
+            for url in (
+                reverse("discussions_list"),
+                reverse("discussions_detail", kwargs={"discussion_id": 1}),
+            ):
+                response = self.client.get(url)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.has_header("ETag"))
+
+    @patch.object(DiscussionListView, "cursor_pagination", True)
+    @patch.object(DiscussionListView, "paginate_by", 1)
+    def test_discussion_list_cursor(self):
+        """ ``GET`` the discussion list page by page with cursors """
+        self.client.login(username="thoas", password="$ecret")
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [r.discussion_id for r in response.context["recipient_list"]], [1]
+        )
+
+        page = response.context["page_obj"]
+        self.assertTrue(page.has_next())
+
+        response = self.client.get(
+            reverse("discussions_list"), {"cursor": page.next_cursor}
+        )
+        self.assertEqual(
+            [r.discussion_id for r in response.context["recipient_list"]], [2]
+        )
+        self.assertFalse(response.context["page_obj"].has_next())
+
+        response = self.client.get(reverse("discussions_list"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
     def test_discussion_sent(self):
         """ ``GET`` the message list for a user """
         self._test_login("discussions_sent")
@@ -390,6 +889,41 @@ class DiscussionsViewsTests(TestCase):
 
         self.assertTemplateUsed(response, "discussions/read.html")
 
+    @patch("discussions.settings.SEQUENCE_READ_TRACKING", True)
+    def test_discussion_status_sequence_read_tracking(self):
+        thoas = User.objects.get(username="thoas")
+        ampelmann = User.objects.get(username="ampelmann")
+
+        discussion = Discussion.objects.get(pk=2)
+        discussion.mark_as_read()
+        discussion.add_message("Reply", ampelmann)
+
+        self.client.login(username="thoas", password="$ecret")
+
+        response = self.client.get(reverse("discussions_unread"))
+        self.assertIn(
+            discussion.pk,
+            [recipient.discussion_id for recipient in response.context["recipient_list"]],
+        )
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertContains(response, "1 new message")
+        self.assertEqual(
+            response.context["recipient_list"][0].discussion_id, discussion.pk
+        )
+
+        response = self.client.get(reverse("discussions_read"))
+        self.assertNotIn(
+            discussion.pk,
+            [recipient.discussion_id for recipient in response.context["recipient_list"]],
+        )
+
+        self.client.get(reverse("discussions_detail", kwargs={"discussion_id": 2}))
+
+        self.assertTrue(
+            Recipient.objects.get(discussion=discussion, user=thoas).is_read()
+        )
+
     def test_discussion_detail_between_two_users(self):
         """ ``GET`` to a detail page between two users """
         self._test_login("discussions_list")
@@ -410,6 +944,44 @@ class DiscussionsViewsTests(TestCase):
 
         self.assertEqual(len(unread_messages), 0)
 
+    def test_discussion_list_correspondent(self):
+        """ ``GET`` the discussions with a given user """
+        thoas = User.objects.get(username="thoas")
+        oleiade = User.objects.get(username="oleiade")
+
+        discussion = Discussion.objects.send_message(oleiade, [thoas], "Hi", "Hi")
+
+        self.client.login(username="thoas", password="$ecret")
+
+        response = self.client.get(
+            reverse("discussions_list", kwargs={"username": "oleiade"})
+        )
+        self.assertEqual(response.context["correspondent"], oleiade)
+        self.assertEqual(
+            [recipient.discussion_id for recipient in response.context["recipient_list"]],
+            [discussion.pk],
+        )
+
+        response = self.client.get(
+            reverse("discussions_list", kwargs={"username": "ampelmann"})
+        )
+        self.assertEqual(
+            sorted(
+                recipient.discussion_id
+                for recipient in response.context["recipient_list"]
+            ),
+            sorted(
+                Recipient.objects.filter(user__username="ampelmann").values_list(
+                    "discussion_id", flat=True
+                )
+            ),
+        )
+
+        response = self.client.get(
+            reverse("discussions_list", kwargs={"username": "unknown"})
+        )
+        self.assertEqual(response.status_code, 404)
+
     def test_folder_list(self):
         """ ``GET`` the discussion list for a user """
         self._test_login("discussions_folders_list")
@@ -562,3 +1134,186 @@ class DiscussionsViewsTests(TestCase):
         self.assertRedirects(response, reverse("discussions_list"))
 
         self.assertFalse(Folder.objects.filter(pk=1).exists())
+
+
+class BroadcastViewsTests(TestCase):
+    fixtures = ["users.json", "messages.json"]
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+        patcher = patch("discussions.settings.BROADCASTS", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.thoas = User.objects.get(username="thoas")
+        self.ampelmann = User.objects.get(username="ampelmann")
+
+        self.discussion = Discussion.objects.send_broadcast(
+            self.thoas, "News", "Body"
+        )
+
+        self.client.login(username="ampelmann", password="$ecret")
+
+    def get_inbox_ids(self):
+        return set(
+            Recipient.objects.filter(user=self.ampelmann, folder__isnull=True)
+            .exclude(status=Recipient.STATUS.deleted)
+            .values_list("discussion_id", flat=True)
+        )
+
+    def get_recipient(self):
+        return Recipient.objects.filter(
+            discussion=self.discussion, user=self.ampelmann
+        ).first()
+
+    @patch.object(DiscussionListView, "paginate_by", 1)
+    def test_discussion_list(self):
+        """ Pending broadcasts are merged into the inbox without saving them """
+        expected = self.get_inbox_ids() | set([self.discussion.pk])
+
+        discussion_ids = []
+
+        for page in range(1, len(expected) + 1):
+            response = self.client.get(reverse("discussions_list"), {"page": page})
+            self.assertEqual(response.status_code, 200)
+
+            discussion_ids += [
+                recipient.discussion_id
+                for recipient in response.context["recipient_list"]
+            ]
+
+        self.assertEqual(sorted(discussion_ids), sorted(expected))
+
+        # The broadcast is the latest discussion
+        response = self.client.get(reverse("discussions_list"))
+        self.assertContains(response, "Announcement")
+
+        response = self.client.get(reverse("discussions_unread"))
+        self.assertEqual(
+            [r.discussion_id for r in response.context["recipient_list"]][0],
+            self.discussion.pk,
+        )
+
+        response = self.client.get(reverse("discussions_sent"))
+        self.assertNotIn(
+            self.discussion.pk,
+            [r.discussion_id for r in response.context["recipient_list"]],
+        )
+
+        self.assertIsNone(self.get_recipient())
+
+    def test_conditional_get_disabled(self):
+        self.client.login(username="thoas", password="$ecret")
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.client.get(
+            reverse("discussions_detail", kwargs={"discussion_id": 1})
+        )
+        self.assertFalse(response.has_header("ETag"))
+
+    @patch.object(ConditionalGetMixin, "conditional_get", True)
+    def test_conditional_get_dummy_cache(self):
+        self.client.login(username="thoas", password="$ecret")
+
+        with patch("discussions.cache.get_cache", return_value=DummyCache("dummy", {})):
+            for url in (
+                reverse("discussions_list"),
+                reverse("discussions_detail", kwargs={"discussion_id": 1}),
+            ):
+                response = self.client.get(url)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.has_header("ETag"))
+
+    @patch.object(DiscussionListView, "cursor_pagination", True)
+    @patch.object(DiscussionListView, "paginate_by", 1)
+    def test_discussion_list_cursor(self):
+        expected = self.get_inbox_ids() | set([self.discussion.pk])
+
+        response = self.client.get(reverse("discussions_list"))
+        discussion_ids = [r.discussion_id for r in response.context["recipient_list"]]
+
+        while response.context["page_obj"].has_next():
+            response = self.client.get(
+                reverse("discussions_list"),
+                {"cursor": response.context["page_obj"].next_cursor},
+            )
+            discussion_ids += [
+                r.discussion_id for r in response.context["recipient_list"]
+            ]
+
+        self.assertEqual(sorted(discussion_ids), sorted(expected))
+
+    @patch.object(ConditionalGetMixin, "conditional_get", True)
+    def test_discussion_list_generation(self):
+        """ A new broadcast changes every inbox """
+        response = self.client.get(reverse("discussions_list"))
+
+        Discussion.objects.send_broadcast(self.thoas, "More news", "Body")
+
+        response = self.client.get(
+            reverse("discussions_list"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_discussion_detail(self):
+        """ Opening a broadcast saves the recipient, read """
+        url = reverse("discussions_detail", kwargs={"discussion_id": self.discussion.pk})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["can_reply"])
+        self.assertNotContains(response, "compose_message_form")
+
+        self.assertTrue(self.get_recipient().is_read())
+
+        # Only the sender posts to a broadcast
+        response = self.client.post(url, data={"message": "Reply"})
+        self.assertEqual(response.status_code, 404)
+
+        self.client.login(username="thoas", password="$ecret")
+        response = self.client.get(url)
+        self.assertTrue(response.context["can_reply"])
+
+    def test_discussion_mark_as_read(self):
+        response = self.client.post(
+            reverse("discussions_mark_as_read"),
+            data={"discussion_ids": [self.discussion.pk]},
+        )
+        self.assertRedirects(response, reverse("discussions_list"))
+
+        self.assertTrue(self.get_recipient().is_read())
+
+    def test_discussion_mark_as_unread_select_all(self):
+        """ Pending broadcasts are only saved when they are selected """
+        for status in ("read", "deleted"):
+            self.client.post(
+                reverse("discussions_mark_as_unread"),
+                data={"select_all": "1", "status": status},
+            )
+
+            self.assertIsNone(self.get_recipient())
+
+        self.client.post(
+            reverse("discussions_mark_as_read"),
+            data={"select_all": "1", "status": "unread"},
+        )
+
+        self.assertTrue(self.get_recipient().is_read())
+
+    def test_discussion_leave(self):
+        """ Leaving a broadcast deletes it for the user """
+        self.client.post(
+            reverse("discussions_leave"), data={"discussion_ids": [self.discussion.pk]}
+        )
+
+        self.assertTrue(self.get_recipient().is_deleted())
+
+        response = self.client.get(reverse("discussions_list"))
+        self.assertNotIn(
+            self.discussion.pk,
+            [r.discussion_id for r in response.context["recipient_list"]],
+        )
@@ -17,6 +17,16 @@ urlpatterns = [
         pre_filter(views.DiscussionDetailView.as_view()),
         name="discussions_detail",
     ),
+    url(
+        r"^view/(?P<discussion_id>[\d]+)/messages/$",
+        pre_filter(views.DiscussionMessagesView.as_view()),
+        name="discussions_messages",
+    ),
+    url(
+        r"^search/$",
+        pre_filter(views.DiscussionSearchView.as_view()),
+        name="discussions_search",
+    ),
     url(
         r"^remove/(?:(?P<folder_id>[\d]+))?$",
         pre_filter(views.DiscussionRemoveView.as_view()),
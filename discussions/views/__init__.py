@@ -14,6 +14,10 @@ DiscussionReadView = load_class(settings.DISCUSSION_READ_VIEW)
 
 DiscussionDetailView = load_class(settings.DISCUSSION_DETAIL_VIEW)
 
+DiscussionMessagesView = load_class(settings.DISCUSSION_MESSAGES_VIEW)
+
+DiscussionSearchView = load_class(settings.DISCUSSION_SEARCH_VIEW)
+
 DiscussionRemoveView = load_class(settings.DISCUSSION_REMOVE_VIEW)
 
 DiscussionMoveView = load_class(settings.DISCUSSION_MOVE_VIEW)
@@ -9,24 +9,111 @@ from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _, ungettext
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.http import Http404
+from django.core.paginator import InvalidPage
+from django.db.models import Subquery
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils.functional import cached_property
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 from django.utils.timezone import now as tznow
 
+import calendar
+import hashlib
+import json
+
 from ..models import Discussion, Folder, Recipient
 from ..forms import ComposeForm, ReplyForm, FolderForm
 from ..helpers import lookup_discussions, lookup_profiles
-from .. import settings
+from .. import cache, settings
 from ..compat import User
+from ..pagination import CursorPaginator, MergedList
+from ..search import search_discussions
 
 from pure_pagination.paginator import Paginator
 
 
-class DiscussionListView(ListView):
+class ConditionalGetMixin(object):
+    """
+    Answers ``GET`` requests with a ``304 Not Modified`` when the page
+    has not changed, before it is computed.
+
+    Validators are derived from the cache generations, they are only
+    computed when ``conditional_get`` is enabled.
+
+    """
+
+    conditional_get = settings.CONDITIONAL_GET
+
+    def get_etag_parts(self):
+        return []
+
+    def get_last_modified(self):
+        return None
+
+    def get_etag(self):
+        session = getattr(self.request, "session", None)
+
+        # The CSRF token embedded in forms changes with the session
+        parts = [
+            self.request.user.pk,
+            session.session_key if session is not None else "",
+            self.request.get_full_path(),
+            get_language(),
+        ] + list(self.get_etag_parts())
+
+        value = ":".join(["%s" % part for part in parts])
+
+        return quote_etag(hashlib.md5(value.encode("utf-8")).hexdigest())
+
+    def get_conditional_response(self, render):
+        """
+        Returns a ``304`` response when the page matches the validators of
+        the request, the response built by ``render`` otherwise.
+
+        """
+        if not self.conditional_get:
+            return render()
+
+        etag = self.get_etag()
+        last_modified = self.get_last_modified()
+
+        if last_modified is not None:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+
+        # Flash messages would not be displayed by a 304
+        if not len(messages.get_messages(self.request)):
+            response = get_conditional_response(
+                self.request, etag=etag, last_modified=last_modified
+            )
+
+            if response is not None:
+                return response
+
+        response = render()
+
+        # Rendering may have changed the state, e.g. marked it as read
+        response["ETag"] = self.get_etag()
+
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+
+        return response
+
+
+class DiscussionListView(ConditionalGetMixin, ListView):
     template_name = "discussions/list.html"
     paginate_by = settings.PAGINATE_BY
     model = Recipient
     context_object_name = "recipient_list"
     paginator_class = Paginator
+    cursor_pagination = settings.CURSOR_PAGINATION
+    cursor_kwarg = "cursor"
+    ordering = ("-last_activity_at", "-pk")
+    row_template_name = "discussions/_discussion.html"
+    rows_cache_timeout = settings.ROWS_CACHE_TIMEOUT
+    include_broadcasts = True
 
     @cached_property
     def user(self):
@@ -45,13 +132,52 @@ class DiscussionListView(ListView):
 
         return folder
 
+    @cached_property
+    def correspondent(self):
+        username = self.kwargs.get("username")
+
+        if not username:
+            return None
+
+        return get_object_or_404(User, username=username)
+
+    def get_etag_parts(self):
+        # Computed without listing the page: the version moves with the
+        # user generation and with any discussion of the user
+        return [self.model.objects.get_inbox_version(self.user)]
+
+    def get(self, request, *args, **kwargs):
+        parent = super(DiscussionListView, self)
+
+        return self.get_conditional_response(
+            lambda: parent.get(request, *args, **kwargs)
+        )
+
+    def get_ordering(self):
+        if settings.SEQUENCE_READ_TRACKING:
+            # Replies do not touch recipients, sort on the discussion
+            return ("-discussion__updated_at", "-pk")
+
+        return self.ordering
+
     def get_base_queryset(self):
         qs = (
             self.model.objects.filter(user=self.user)
-            .order_by("-discussion__updated_at", "-discussion__created_at")
+            .order_by(*self.get_ordering())
             .select_related("user")
         )
 
+        if self.correspondent:
+            # Probes the (user, discussion) index of the correspondent for
+            # each discussion, without joining discussions
+            qs = qs.filter(
+                discussion__in=Subquery(
+                    self.model.objects.filter(user=self.correspondent).values(
+                        "discussion_id"
+                    )
+                )
+            )
+
         return qs
 
     def get_queryset(self):
@@ -70,16 +196,125 @@ class DiscussionListView(ListView):
 
         return qs
 
+    def get_pending_recipients(self):
+        """
+        Returns unsaved recipients of the broadcasts the user has no
+        recipient for yet, merged into the inbox.
+
+        """
+        if not self.include_broadcasts or self.folder or self.correspondent:
+            return []
+
+        return self.model.objects.get_pending(self.user)
+
+    def get_ordering_values(self, recipient):
+        """
+        Returns the ordering values of an unsaved recipient, it comes
+        after saved ones on ties.
+
+        """
+        values = []
+
+        for field in self.get_ordering():
+            field = field.lstrip("-")
+
+            if field == "pk":
+                values.append(-recipient.discussion_id)
+                continue
+
+            value = recipient
+
+            for name in field.split("__"):
+                value = getattr(value, name)
+
+            values.append(value)
+
+        return values
+
+    def paginate_queryset(self, queryset, page_size):
+        extra = [
+            (self.get_ordering_values(recipient), recipient)
+            for recipient in self.get_pending_recipients()
+        ]
+
+        if not self.cursor_pagination:
+            if extra:
+                queryset = MergedList(queryset, self.get_ordering(), extra)
+
+            return super(DiscussionListView, self).paginate_queryset(
+                queryset, page_size
+            )
+
+        paginator = CursorPaginator(queryset, page_size, self.get_ordering(), extra)
+
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage:
+            raise Http404
+
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         context = super(DiscussionListView, self).get_context_data(**kwargs)
 
         lookup_discussions(context[self.context_object_name])
         lookup_profiles(context[self.context_object_name])
 
+        if self.rows_cache_timeout is not None:
+            self.render_rows(context[self.context_object_name])
+
         context["folder"] = self.folder
+        context["correspondent"] = self.correspondent
 
         return context
 
+    def get_row_key(self, recipient, generation):
+        return cache.row_key(
+            recipient.discussion_id,
+            self.user.pk,
+            generation,
+            recipient.status,
+            recipient.count_new_messages(),
+            get_language(),
+            recipient.discussion.get_version(),
+        )
+
+    def render_rows(self, recipients):
+        """
+        Attaches the rendered inbox row of each recipient as ``row``, rows
+        of the page are fetched from the cache at once and only the missing
+        ones are rendered.
+
+        """
+        backend = cache.get_cache()
+
+        generations = cache.get_discussion_generations(
+            [recipient.discussion_id for recipient in recipients]
+        )
+
+        keys = [
+            (self.get_row_key(recipient, generations[recipient.discussion_id]), recipient)
+            for recipient in recipients
+        ]
+        rows = backend.get_many([key for key, recipient in keys])
+        missing = {}
+
+        for key, recipient in keys:
+            if key not in rows:
+                rows[key] = missing[key] = render_to_string(
+                    self.row_template_name,
+                    {
+                        "discussion": recipient.discussion,
+                        "recipient": recipient,
+                        "user": self.user,
+                    },
+                )
+
+            recipient.row = mark_safe(rows[key])
+
+        if missing:
+            backend.set_many(missing, self.rows_cache_timeout)
+
 
 class FoldersListView(ListView):
     template_name = "discussions/folder/list.html"
@@ -94,7 +329,99 @@ class FoldersListView(ListView):
         return qs
 
 
-class DiscussionDetailView(DetailView, FormMixin):
+class DiscussionObjectMixin(object):
+    def get_object(self, queryset=None):
+        """
+        Loads the discussion along with the recipient of the current user,
+        which answers the access check.
+
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        try:
+            return self.model.objects.get_for_user(
+                self.kwargs.get(self.pk_url_kwarg), self.request.user, queryset
+            )
+        except self.model.DoesNotExist:
+            raise Http404
+
+
+class DiscussionMessagesMixin(object):
+    messages_paginate_by = settings.MESSAGES_PAGINATE_BY
+    messages_ordering = ("-sent_at", "-pk")
+    messages_cursor_kwarg = "cursor"
+    messages_cache_timeout = settings.MESSAGES_CACHE_TIMEOUT
+
+    def get_messages(self, discussion):
+        return discussion.messages.select_related("sender")
+
+    def get_messages_paginator(self, discussion):
+        return CursorPaginator(
+            self.get_messages(discussion),
+            self.messages_paginate_by,
+            self.messages_ordering,
+        )
+
+    def get_messages_key(self, discussion, cursor):
+        # Cursors come from the request, the key depends on their decoded
+        # values instead so that invalid ones never reach the cache
+        position = ""
+
+        if cursor:
+            try:
+                values = self.get_messages_paginator(discussion).decode(cursor)
+            except InvalidPage:
+                raise Http404
+
+            position = hashlib.md5(json.dumps(values).encode("utf-8")).hexdigest()
+
+        # A new message changes both the count and the latest message,
+        # windows of the previous state are never served again
+        return cache.messages_key(
+            discussion.pk,
+            position,
+            self.messages_paginate_by,
+            discussion.messages_count,
+            discussion.latest_message_id,
+        )
+
+    def get_messages_context_data(self, discussion, cursor=None):
+        """
+        Returns the window of messages preceding ``cursor``, the latest
+        ones when it is empty, in chronological order.
+
+        Windows are the same for every participant, they are shared in the
+        cache when ``messages_cache_timeout`` is set.
+
+        """
+        return cache.get_or_compute(
+            self.get_messages_key(discussion, cursor),
+            lambda: self.compute_messages_context_data(discussion, cursor),
+            self.messages_cache_timeout,
+        )
+
+    def compute_messages_context_data(self, discussion, cursor):
+        paginator = self.get_messages_paginator(discussion)
+
+        try:
+            page = paginator.page(cursor)
+        except InvalidPage:
+            raise Http404
+
+        return {
+            "message_list": list(reversed(page.object_list)),
+            "older_messages_cursor": page.next_cursor,
+        }
+
+
+class DiscussionDetailView(
+    DiscussionObjectMixin,
+    ConditionalGetMixin,
+    DetailView,
+    FormMixin,
+    DiscussionMessagesMixin,
+):
     pk_url_kwarg = "discussion_id"
     model = Discussion
     context_object_name = "discussion"
@@ -107,34 +434,63 @@ class DiscussionDetailView(DetailView, FormMixin):
     def is_allowed(self, user):
         return self.object.can_view(user)
 
+    def can_reply(self, user):
+        # Broadcasts are announcements, only their sender posts to them
+        return not self.object.is_broadcast() or self.object.sender_id == user.pk
+
+    def get_etag_parts(self):
+        # Marking as read bumps the generation, it is not cached
+        return [self.object.get_version(), cache.get_generation(self.request.user.pk)]
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+
+        if not self.is_allowed(request.user):
+            raise Http404
+
+        return self.get_conditional_response(
+            lambda: self.render_to_response(self.get_context_data(object=self.object))
+        )
+
     def get_context_data(self, **kwargs):
         data = super(DiscussionDetailView, self).get_context_data(**kwargs)
 
         if not self.is_allowed(self.request.user):
             raise Http404
 
-        self.object.mark_as_read(self.request.user)
+        # The recipient has been loaded by the access check, only
+        # write when the state of the user actually changes, recipients
+        # of broadcasts are saved when they are first opened
+        recipient = self.object.get_or_create_recipient(self.request.user)
+
+        if recipient is not None and not recipient.is_read():
+            recipient.mark_as_read()
 
-        recipients = self.object.recipients.all()
+        # Participants of the snapshot, the membership may be huge
+        recipients = User.objects.filter(
+            pk__in=[participant["id"] for participant in self.object.get_participants()]
+        )
+
+        data.update(self.get_messages_context_data(self.object))
 
         return dict(
             data,
             **{
                 "recipient_list": recipients,
                 "form": self.get_form(self.get_form_class()),
-                "message_list": self.get_messages(self.object),
+                "can_reply": self.can_reply(self.request.user),
             }
         )
 
-    def get_messages(self, discussion):
-        return discussion.messages.order_by("sent_at")
-
     def get_template_names(self):
         return [self.template_name]
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
 
+        if not self.can_reply(request.user):
+            raise Http404
+
         form_class = self.get_form_class()
         form = self.get_form(form_class)
 
@@ -155,6 +511,89 @@ class DiscussionDetailView(DetailView, FormMixin):
         )
 
 
+class DiscussionMessagesView(
+    DiscussionObjectMixin, DetailView, DiscussionMessagesMixin
+):
+    """
+    Renders the window of messages preceding the ``cursor`` given in the
+    querystring, to load older messages of a discussion.
+
+    """
+
+    http_method_names = ["get"]
+    pk_url_kwarg = "discussion_id"
+    model = Discussion
+    context_object_name = "discussion"
+    template_name = "discussions/_messages.html"
+
+    def get_context_data(self, **kwargs):
+        data = super(DiscussionMessagesView, self).get_context_data(**kwargs)
+
+        if not self.object.can_view(self.request.user):
+            raise Http404
+
+        return dict(
+            data,
+            **self.get_messages_context_data(
+                self.object, self.request.GET.get(self.messages_cursor_kwarg)
+            )
+        )
+
+    def get_template_names(self):
+        return [self.template_name]
+
+
+class DiscussionSearchView(ListView):
+    """
+    Lists discussions of the user matching the ``q`` querystring
+    parameter, the most relevant first.
+
+    """
+
+    template_name = "discussions/search.html"
+    paginate_by = settings.PAGINATE_BY
+    context_object_name = "recipient_list"
+    paginator_class = Paginator
+    query_kwarg = "q"
+
+    @cached_property
+    def query(self):
+        return self.request.GET.get(self.query_kwarg, "").strip()
+
+    def get_queryset(self):
+        if not self.query:
+            return []
+
+        return search_discussions(self.request.user, self.query)
+
+    def get_context_data(self, **kwargs):
+        context = super(DiscussionSearchView, self).get_context_data(**kwargs)
+
+        discussion_ids = context["object_list"]
+
+        recipients = dict(
+            (recipient.discussion_id, recipient)
+            for recipient in Recipient.objects.filter(
+                user=self.request.user, discussion__in=discussion_ids
+            )
+            .exclude(status=Recipient.STATUS.deleted)
+            .select_related("user")
+        )
+
+        recipient_list = [
+            recipients[discussion_id]
+            for discussion_id in discussion_ids
+            if discussion_id in recipients
+        ]
+
+        lookup_discussions(recipient_list)
+
+        context[self.context_object_name] = recipient_list
+        context["query"] = self.query
+
+        return context
+
+
 class MessageComposeView(FormView):
     form_class = ComposeForm
     template_name = "discussions/form.html"
@@ -234,6 +673,60 @@ class DiscussionBulkMixin(object):
 
         return valid_discussion_id_list
 
+    def get_recipients(self):
+        """
+        Returns the recipients of the user targeted by the request.
+
+        POST can have the following keys:
+
+            ``discussions_ids``
+                List of discussion id's to act on.
+
+            ``select_all``
+                Act on every discussion of the folder given in the URI,
+                or of the inbox, instead of ``discussion_ids``.
+
+            ``status``
+                With ``select_all``, only act on discussions with this status
+                (``read``, ``unread`` or ``deleted``), deleted discussions
+                are excluded otherwise.
+        """
+        qs = Recipient.objects.filter(user=self.request.user)
+
+        if not self.request.POST.get("select_all"):
+            discussion_ids = self.valid_ids(self.request.POST.getlist("discussion_ids"))
+
+            # Broadcasts get a recipient before their status changes
+            Recipient.objects.save_pending(self.request.user, discussion_ids)
+
+            return qs.filter(discussion__in=discussion_ids)
+
+        folder_id = self.kwargs.get("folder_id")
+        status = self.request.POST.get("status")
+
+        if folder_id:
+            qs = qs.filter(folder=folder_id)
+        else:
+            # Pending broadcasts are unread, other statuses never select them
+            if status in (None, "", "unread"):
+                Recipient.objects.save_pending(self.request.user)
+
+            qs = qs.filter(folder__isnull=True)
+
+        if not status:
+            return qs.exclude(status=Recipient.STATUS.deleted)
+
+        statuses = {
+            "read": Recipient.STATUS.read,
+            "unread": Recipient.STATUS.unread,
+            "deleted": Recipient.STATUS.deleted,
+        }
+
+        if status not in statuses:
+            return qs.none()
+
+        return qs.filter(Recipient.objects.get_status_filter(statuses[status]))
+
 
 class DiscussionMoveView(DetailView, DiscussionBulkMixin):
     http_method_names = ["post"]
@@ -262,10 +755,16 @@ class DiscussionMoveView(DetailView, DiscussionBulkMixin):
         discussion_ids = self.request.POST.getlist("discussion_ids")
 
         if discussion_ids:
+            discussion_ids = self.valid_ids(discussion_ids)
+
+            Recipient.objects.save_pending(self.request.user, discussion_ids)
+
             Recipient.objects.filter(
-                discussion__in=self.valid_ids(discussion_ids), user=self.request.user
+                discussion__in=discussion_ids, user=self.request.user
             ).update(folder=self.object)
 
+            cache.bump_generations([self.request.user.pk])
+
         return redirect(reverse("discussions_list"))
 
 
@@ -274,25 +773,15 @@ class DiscussionMarkAsReadView(View, DiscussionBulkMixin):
 
     def post(self, *args, **kwargs):
         """
-        A ``POST`` to mark as read discussions.
-
-        :param unread:
-            A Boolean that if ``True`` unread discussions.
-
-        POST can have the following keys:
+        A ``POST`` to mark as read discussions with a single UPDATE.
 
-            ``discussions_ids``
-                List of discussion id's that should be marked as read.
+        See :meth:`DiscussionBulkMixin.get_recipients` for the keys
+        selecting discussions.
         """
 
-        discussion_ids = self.request.POST.getlist("discussion_ids")
-
-        if discussion_ids:
-            recipients = Recipient.objects.filter(
-                discussion__in=self.valid_ids(discussion_ids), user=self.request.user
-            ).exclude(status=Recipient.STATUS.read)
-            for recipient in recipients:
-                recipient.mark_as_read()
+        Recipient.objects.update_status(
+            self.get_recipients(), Recipient.STATUS.read, read_at=tznow()
+        )
 
         folder_id = self.kwargs.get("folder_id")
 
@@ -309,22 +798,13 @@ class DiscussionMarkAsUnreadView(View, DiscussionBulkMixin):
 
     def post(self, *args, **kwargs):
         """
-        A ``POST`` to mark as unread discussions.
-
-        POST can have the following keys:
+        A ``POST`` to mark as unread discussions with a single UPDATE.
 
-            ``discussions_ids``
-                List of discussion id's that should be marked as unread.
+        See :meth:`DiscussionBulkMixin.get_recipients` for the keys
+        selecting discussions.
         """
 
-        discussion_ids = self.request.POST.getlist("discussion_ids")
-
-        if discussion_ids:
-            recipients = Recipient.objects.filter(
-                discussion__in=self.valid_ids(discussion_ids), user=self.request.user
-            ).exclude(status=Recipient.STATUS.unread)
-            for recipient in recipients:
-                recipient.mark_as_unread()
+        Recipient.objects.update_status(self.get_recipients(), Recipient.STATUS.unread)
 
         folder_id = self.kwargs.get("folder_id")
 
@@ -356,16 +836,52 @@ class DiscussionLeaveView(View, DiscussionBulkMixin):
 
         """
 
-        discussion_ids = self.request.POST.getlist("discussion_ids")
+        discussion_ids = self.valid_ids(self.request.POST.getlist("discussion_ids"))
         redirect_to = self.request.POST.get("next", False)
 
         if discussion_ids:
-            for pk in self.valid_ids(discussion_ids):
-                discussion = get_object_or_404(Discussion, pk=pk)
+            discussions = list(
+                Discussion.objects.filter(pk__in=discussion_ids)
+                .only("subject", "sender", "audience")
+                .order_by("pk")
+            )
+
+            # The creator of a discussion cannot leave it
+            leaving = [
+                discussion
+                for discussion in discussions
+                if discussion.sender_id != self.request.user.pk
+            ]
+
+            Recipient.objects.delete_recipients(
+                Recipient.objects.filter(
+                    user=self.request.user,
+                    discussion__in=[
+                        discussion.pk
+                        for discussion in leaving
+                        if not discussion.is_broadcast()
+                    ],
+                )
+            )
 
-                result = discussion.delete_recipient(self.request.user)
+            # Users stay in the audience of a broadcast, it is deleted instead
+            broadcast_ids = [
+                discussion.pk for discussion in leaving if discussion.is_broadcast()
+            ]
+
+            if broadcast_ids:
+                Recipient.objects.save_pending(self.request.user, broadcast_ids)
+
+                Recipient.objects.update_status(
+                    Recipient.objects.filter(
+                        user=self.request.user, discussion__in=broadcast_ids
+                    ),
+                    Recipient.STATUS.deleted,
+                    deleted_at=tznow(),
+                )
 
-                if result:
+            for discussion in discussions:
+                if discussion.sender_id != self.request.user.pk:
                     messages.success(
                         self.request,
                         _('You have successfully left the discussion "%s"')
@@ -408,39 +924,42 @@ class DiscussionRemoveView(View, DiscussionBulkMixin):
         The ``next`` value can also be supplied in the URI with ``?next=<value>``.
 
         """
-        discussion_ids = self.request.POST.getlist("discussion_ids")
+        discussion_ids = self.valid_ids(self.request.POST.getlist("discussion_ids"))
         redirect_to = self.request.POST.get("next", False)
         undo = self.kwargs.get("undo", False)
 
         if discussion_ids:
-            # Delete all the messages, if they belong to the user.
             now = tznow()
-            changed_message_list = set()
-            for pk in self.valid_ids(discussion_ids):
-                discussion = get_object_or_404(Discussion, pk=pk)
-
-                # Check if the user is the owner
-                if discussion.sender_id == self.request.user.pk:
-                    if undo:
-                        discussion.sender_deleted_at = None
-                    else:
-                        discussion.sender_deleted_at = now
-                    discussion.save()
-                    changed_message_list.add(discussion.pk)
-
-                # Check if the user is a recipient of the message
-                recipients = discussion.recipient_set.filter(
-                    user=self.request.user, discussion=discussion
-                )
 
-                if recipients:
-                    for recipient in recipients:
-                        if undo:
-                            recipient.mark_as_read()
-                        else:
-                            recipient.mark_as_deleted()
+            # Discussions created by the user
+            discussions = Discussion.objects.filter(
+                pk__in=discussion_ids, sender=self.request.user
+            )
+
+            changed_message_list = set(discussions.values_list("pk", flat=True))
+
+            if changed_message_list:
+                discussions.update(sender_deleted_at=None if undo else now)
+
+            Recipient.objects.save_pending(self.request.user, discussion_ids)
+
+            # Discussions the user is a recipient of
+            recipients = Recipient.objects.filter(
+                discussion__in=discussion_ids, user=self.request.user
+            )
+
+            changed_message_list.update(
+                recipients.values_list("discussion_id", flat=True)
+            )
 
-                    changed_message_list.add(discussion.pk)
+            if undo:
+                Recipient.objects.update_status(
+                    recipients, Recipient.STATUS.read, read_at=now
+                )
+            else:
+                Recipient.objects.update_status(
+                    recipients, Recipient.STATUS.deleted, deleted_at=now
+                )
 
             # Send messages
             if len(changed_message_list) > 0:
@@ -4,11 +4,12 @@ from .. import settings
 
 class DiscussionSentView(load_class(settings.DISCUSSION_LIST_VIEW)):
     template_name = "discussions/sent.html"
+    include_broadcasts = False
 
     def get_queryset(self):
         return (
             self.get_base_queryset()
-            .filter(discussion__sender=self.user, folder=self.folder)
+            .filter(is_sender=True, folder=self.folder)
             .exclude(status=self.model.STATUS.deleted)
         )
 
@@ -18,21 +19,25 @@ class DiscussionUnreadView(load_class(settings.DISCUSSION_LIST_VIEW)):
 
     def get_queryset(self):
         return self.get_base_queryset().filter(
-            status=self.model.STATUS.unread, folder=self.folder
+            self.model.objects.get_status_filter(self.model.STATUS.unread),
+            folder=self.folder,
         )
 
 
 class DiscussionReadView(load_class(settings.DISCUSSION_LIST_VIEW)):
     template_name = "discussions/read.html"
+    include_broadcasts = False
 
     def get_queryset(self):
         return self.get_base_queryset().filter(
-            status=self.model.STATUS.read, folder=self.folder
+            self.model.objects.get_status_filter(self.model.STATUS.read),
+            folder=self.folder,
         )
 
 
 class DiscussionDeletedView(load_class(settings.DISCUSSION_LIST_VIEW)):
     template_name = "discussions/deleted.html"
+    include_broadcasts = False
 
     def get_queryset(self):
         return self.get_base_queryset().filter(